@@ -12,6 +12,7 @@ HANDLER="src/tiktok_data_collect_s3.lambda_handler"
 MEMORY_SIZE=3008  # Maximum memory for Lambda
 TIMEOUT=900       # 15 minutes (maximum for Lambda)
 REGION="ap-northeast-2"
+ARCHITECTURE="x86_64"  # Pillow-SIMD only has SSE4/AVX2 paths, no arm64/NEON
 
 # Directories
 PACKAGE_DIR="lambda_package"
@@ -32,6 +33,15 @@ mkdir -p $PACKAGE_DIR
 echo "📚 Installing Python dependencies..."
 pip install -r lambda_requirements.txt -t $PACKAGE_DIR --no-deps
 
+# Pillow-SIMD + libjpeg-turbo have to be compiled for the Lambda runtime, so build them in Docker
+echo "🖼️  Building Pillow-SIMD (AVX2) against libjpeg-turbo..."
+docker build --platform linux/amd64 -f Dockerfile.pillow-simd -t tiktok-pillow-simd .
+PILLOW_CONTAINER=$(docker create --platform linux/amd64 tiktok-pillow-simd)
+mkdir -p $PACKAGE_DIR/lib
+docker cp $PILLOW_CONTAINER:/opt/python/. $PACKAGE_DIR/
+docker cp $PILLOW_CONTAINER:/opt/lib/. $PACKAGE_DIR/lib/
+docker rm $PILLOW_CONTAINER
+
 # Note: Some packages like pandas and Pillow are large
 # Consider using Lambda Layers for common dependencies
 
@@ -70,6 +80,7 @@ echo "  --function-name $FUNCTION_NAME \\"
 echo "  --runtime $RUNTIME \\"
 echo "  --role arn:aws:iam::777022888924:role/lambda-socialmediaanalyzer-collector-role \\"
 echo "  --handler $HANDLER \\"
+echo "  --architectures $ARCHITECTURE \\"
 echo "  --zip-file fileb://lambda_deployment.zip \\"
 echo "  --memory-size $MEMORY_SIZE \\"
 echo "  --timeout $TIMEOUT \\"
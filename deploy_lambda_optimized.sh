@@ -13,6 +13,7 @@ HANDLER="src/tiktok_data_collect_s3.lambda_handler"
 MEMORY_SIZE=3008  # Maximum memory for Lambda
 TIMEOUT=900       # 15 minutes (maximum for Lambda)
 REGION="ap-northeast-2"
+ARCHITECTURE="x86_64"  # Pillow-SIMD only has SSE4/AVX2 paths, no arm64/NEON
 
 # Directories
 LAYER_DIR="lambda_layer"
@@ -38,14 +39,34 @@ boto3==1.34.34
 botocore==1.34.34
 pandas==2.1.4
 pyarrow==14.0.2
-Pillow==10.2.0
 requests==2.31.0
+httpx==0.26.0
+httpcore==1.0.2
+h11==0.14.0
+h2==4.1.0
+hpack==4.0.0
+hyperframe==6.0.1
+anyio==4.2.0
+sniffio==1.3.0
+exceptiongroup==1.2.0
+typing_extensions==4.9.0
+certifi==2023.11.17
+idna==3.6
 aiofiles==23.2.1
 EOF
 
 # Install layer dependencies
 pip install -r layer_requirements.txt -t $LAYER_DIR/python --no-deps
 
+# Pillow-SIMD + libjpeg-turbo have to be compiled for the Lambda runtime, so build them in Docker
+echo "🖼️  Building Pillow-SIMD (AVX2) against libjpeg-turbo..."
+docker build --platform linux/amd64 -f Dockerfile.pillow-simd -t tiktok-pillow-simd .
+PILLOW_CONTAINER=$(docker create --platform linux/amd64 tiktok-pillow-simd)
+mkdir -p $LAYER_DIR/lib
+docker cp $PILLOW_CONTAINER:/opt/python/. $LAYER_DIR/python/
+docker cp $PILLOW_CONTAINER:/opt/lib/. $LAYER_DIR/lib/
+docker rm $PILLOW_CONTAINER
+
 # Create layer package
 echo "🗜️  Creating Lambda Layer package..."
 cd $LAYER_DIR
@@ -96,6 +117,7 @@ LAYER_VERSION=$(aws lambda publish-layer-version \
     --layer-name $LAYER_NAME \
     --zip-file fileb://lambda_layer.zip \
     --compatible-runtimes $RUNTIME \
+    --compatible-architectures $ARCHITECTURE \
     --region $REGION \
     --query 'Version' --output text)
 
@@ -131,6 +153,7 @@ if [[ $REPLY =~ ^[Yy]$ ]]; then
             --runtime $RUNTIME \
             --role arn:aws:iam::777022888924:role/lambda-socialmediaanalyzer-collector-role \
             --handler $HANDLER \
+            --architectures $ARCHITECTURE \
             --zip-file fileb://lambda_deployment_minimal.zip \
             --memory-size $MEMORY_SIZE \
             --timeout $TIMEOUT \
@@ -143,7 +166,7 @@ else
     echo ""
     echo "Manual deployment commands:"
     echo "1. Deploy layer:"
-    echo "   aws lambda publish-layer-version --layer-name $LAYER_NAME --zip-file fileb://lambda_layer.zip --compatible-runtimes $RUNTIME --region $REGION"
+    echo "   aws lambda publish-layer-version --layer-name $LAYER_NAME --zip-file fileb://lambda_layer.zip --compatible-runtimes $RUNTIME --compatible-architectures $ARCHITECTURE --region $REGION"
     echo ""
     echo "2. Create function:"
     echo "   aws lambda create-function \\"
@@ -151,6 +174,7 @@ else
     echo "     --runtime $RUNTIME \\"
     echo "     --role arn:aws:iam::777022888924:role/lambda-socialmediaanalyzer-collector-role \\"
     echo "     --handler $HANDLER \\"
+    echo "     --architectures $ARCHITECTURE \\"
     echo "     --zip-file fileb://lambda_deployment_minimal.zip \\"
     echo "     --memory-size $MEMORY_SIZE \\"
     echo "     --timeout $TIMEOUT \\"
@@ -12,6 +12,7 @@ HANDLER="tiktok_data_collect_s3.lambda_handler"
 MEMORY_SIZE=3008  # Maximum memory for Lambda
 TIMEOUT=900       # 15 minutes (maximum for Lambda)
 REGION="ap-northeast-2"
+ARCHITECTURE="x86_64"  # Pillow-SIMD only has SSE4/AVX2 paths, no arm64/NEON
 
 # Directories
 PACKAGE_DIR="lambda_package_simple"
@@ -34,11 +35,22 @@ cat > simple_requirements.txt << 'EOF'
 boto3==1.34.34
 botocore==1.34.34
 requests==2.31.0
+httpx==0.26.0
+httpcore==1.0.2
+h11==0.14.0
+h2==4.1.0
+hpack==4.0.0
+hyperframe==6.0.1
+anyio==4.2.0
+sniffio==1.3.0
+exceptiongroup==1.2.0
+typing_extensions==4.9.0
+certifi==2023.11.17
+idna==3.6
 TikTokApi==6.1.0
 aiofiles==23.2.1
 pyarrow==14.0.2
 pandas==2.1.4
-Pillow==10.2.0
 EOF
 
 # Install dependencies with optimizations
@@ -59,6 +71,15 @@ rm -rf $PACKAGE_DIR/pandas/tests 2>/dev/null || true
 rm -rf $PACKAGE_DIR/PIL/tests 2>/dev/null || true
 rm -rf $PACKAGE_DIR/numpy/tests 2>/dev/null || true
 
+# Pillow-SIMD + libjpeg-turbo have to be compiled for the Lambda runtime, so build them in Docker
+echo "🖼️  Building Pillow-SIMD (AVX2) against libjpeg-turbo..."
+docker build --platform linux/amd64 -f Dockerfile.pillow-simd -t tiktok-pillow-simd .
+PILLOW_CONTAINER=$(docker create --platform linux/amd64 tiktok-pillow-simd)
+mkdir -p $PACKAGE_DIR/lib
+docker cp $PILLOW_CONTAINER:/opt/python/. $PACKAGE_DIR/
+docker cp $PILLOW_CONTAINER:/opt/lib/. $PACKAGE_DIR/lib/
+docker rm $PILLOW_CONTAINER
+
 # Copy optimized source code
 echo "📋 Copying optimized source code..."
 cp $SRC_DIR/tiktok_data_collect_s3_optimized.py $PACKAGE_DIR/tiktok_data_collect_s3.py
@@ -91,6 +112,7 @@ if [ $PACKAGE_SIZE_BYTES -gt 52428800 ]; then  # 50MB limit
     echo "     --runtime $RUNTIME \\"
     echo "     --role arn:aws:iam::777022888924:role/lambda-socialmediaanalyzer-collector-role \\"
     echo "     --handler $HANDLER \\"
+    echo "     --architectures $ARCHITECTURE \\"
     echo "     --code S3Bucket=socialmediaanalyzer,S3Key=lambda-deployments/lambda_deployment_simple.zip \\"
     echo "     --memory-size $MEMORY_SIZE \\"
     echo "     --timeout $TIMEOUT \\"
@@ -136,6 +158,7 @@ if [[ $REPLY =~ ^[Yy]$ ]]; then
                 --runtime $RUNTIME \
                 --role arn:aws:iam::777022888924:role/lambda-socialmediaanalyzer-collector-role \
                 --handler $HANDLER \
+                --architectures $ARCHITECTURE \
                 --code S3Bucket=socialmediaanalyzer,S3Key=lambda-deployments/lambda_deployment_simple.zip \
                 --memory-size $MEMORY_SIZE \
                 --timeout $TIMEOUT \
@@ -156,6 +179,7 @@ if [[ $REPLY =~ ^[Yy]$ ]]; then
                 --runtime $RUNTIME \
                 --role arn:aws:iam::777022888924:role/lambda-socialmediaanalyzer-collector-role \
                 --handler $HANDLER \
+                --architectures $ARCHITECTURE \
                 --zip-file fileb://lambda_deployment_simple.zip \
                 --memory-size $MEMORY_SIZE \
                 --timeout $TIMEOUT \
@@ -7,21 +7,30 @@ posted exactly 30 days ago. Save:
     • view, like, share, comment counts
     • top-5 comments
     • local path to 256×256 JPEG thumbnail
-Result is written to a Parquet file ready for ML ingestion.
+Each run streams its rows into a Parquet part under tiktok_data/parts/,
+ready for ML ingestion (read the directory as one dataset).
 """
 
-import os, re, json, time, random, datetime as dt
+import os, re, json, time, datetime as dt
 import asyncio
+import multiprocessing
+import http.cookiejar
+import heapq
+from contextlib import asynccontextmanager
 from pathlib import Path
-import traceback
-from typing import List, Dict
-import pandas as pd
-from PIL import Image
+import logging
 from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Optional
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from PIL import Image
 import glob
 from tqdm import tqdm
 from TikTokApi import TikTokApi
-import requests
+from TikTokApi.exceptions import CaptchaException, EmptyResponseException
+import httpx
 import matplotlib.pyplot as plt
 
 # ---------- tweakables ----------
@@ -58,123 +67,460 @@ REQUEST_CAP        = 5000          # hard maximum attempts per run
 OUT_DIR            = Path("tiktok_data")
 THUMBS_DIR         = OUT_DIR / "thumbnails"
 THUMBS_DIR.mkdir(parents=True, exist_ok=True)
-BATCH_SIZE         = 1000         # Save to parquet file after this many rows
+PARTS_DIR          = OUT_DIR / "parts"   # one parquet part per run
+LEGACY_DATASET     = OUT_DIR / "tiktok_beauty_dataset.parquet"  # pre-parts single file, migrated by main()
+BATCH_SIZE         = 1000         # videos fanned out per round; rows are written after each round
+MIN_CONCURRENCY    = 1            # adaptive limiter floor when TikTok pushes back
+INITIAL_CONCURRENCY = 4           # videos in flight at start of run
+MAX_CONCURRENCY    = 32           # adaptive limiter ceiling
+OVERLOAD_RETRIES   = 3            # attempts per video before giving up on rate limits
+REQUESTS_PER_SECOND = 5.0         # hard ceiling on TikTok API calls (feed and comment pages) across all tags
+SKIP_OLD_VIDEOS    = False        # drop videos posted before TIME_LIMIT
+NUM_SESSIONS       = 3            # browser sessions; tags are collected this many at a time
+LOG_LEVEL          = os.environ.get("LOG_LEVEL", "INFO")  # DEBUG shows per-video/comment messages
 # --------------------------------
 # 
-# Calculate the timestamp for 1 year ago from now
-TIME_LIMIT = (dt.datetime.utcnow() - dt.timedelta(days=90)).timestamp()
+logging.basicConfig(level=LOG_LEVEL)
+logger = logging.getLogger(__name__)
+logger.setLevel(LOG_LEVEL)
+
+# Calculate the timestamp for 90 days ago from now, as int epoch seconds for a cheap compare
+TIME_LIMIT = int((dt.datetime.now(dt.timezone.utc) - dt.timedelta(days=90)).timestamp())
+
+# zstd keeps the text-heavy description/comment columns ~2x smaller than the
+# default snappy at similar speed; statistics let readers skip row groups
+PARQUET_OPTIONS = dict(compression="zstd", compression_level=3, write_statistics=True)
+ROW_GROUP_SIZE = 1024
+
+# Errors TikTok raises when it is rate limiting us (captcha wall or blank responses)
+OVERLOAD_EXCEPTIONS = (CaptchaException, EmptyResponseException)
+
+# Explicit column types so batches skip pandas' object-dtype inference
+SCHEMA = pa.schema([
+    ("video_id", pa.string()),
+    ("posted_ts", pa.timestamp("s", tz="UTC")),
+    ("description", pa.string()),
+    ("hashtags", pa.list_(pa.string())),  # derived from description in write_rows
+    ("author_id", pa.string()),
+    ("author_name", pa.string()),
+    ("follower_count", pa.int64()),
+    ("view_count", pa.int64()),
+    ("like_count", pa.int64()),
+    ("share_count", pa.int64()),
+    ("comment_count", pa.int64()),
+    ("repost_count", pa.int64()),
+    ("top_comments", pa.list_(pa.string())),
+    ("thumbnail_path", pa.string()),
+])
+
+# What build_row produces; hashtags are added when the batch is written
+ROW_SCHEMA = SCHEMA.remove(SCHEMA.get_field_index("hashtags"))
+
+STAT_KEYS = ("playCount", "diggCount", "shareCount", "commentCount", "repostCount")
+
+HASHTAG_RE = re.compile(r"#([A-Za-z0-9_]+)")
+
+# Pillow resize + optimize=True JPEG encode is CPU-bound; spread it over cores
+_THUMB_POOL: Optional[ProcessPoolExecutor] = None
 
 # Legacy date calculation (not used with new filter logic)
-TARGET_DATE = (dt.datetime.utcnow() - dt.timedelta(days=30)).date() 
-TARGET_START = dt.datetime.combine(TARGET_DATE, dt.time.min).timestamp()
-TARGET_END   = dt.datetime.combine(TARGET_DATE, dt.time.max).timestamp()
+# (int epoch seconds, UTC day bounds, so they compare directly with posted_ts)
+TARGET_DATE = (dt.datetime.now(dt.timezone.utc) - dt.timedelta(days=30)).date()
+TARGET_START = int(dt.datetime.combine(TARGET_DATE, dt.time.min, dt.timezone.utc).timestamp())
+TARGET_END   = int(dt.datetime.combine(TARGET_DATE, dt.time.max, dt.timezone.utc).timestamp())
 
-def resize_and_save(img_bytes: bytes, out_path: Path) -> None:
-    im = Image.open(BytesIO(img_bytes)).convert("RGB")
-    im = im.resize((256, 256), Image.LANCZOS)
+def resize_and_save(data: bytes, out_path: Path) -> None:
+    # draft() lets libjpeg decode JPEG covers at 1/2..1/8 scale; PNG/WebP ignore it.
+    # The drafted image is already within 2x of 256px, where BILINEAR is
+    # indistinguishable from LANCZOS for thumbnails and much cheaper.
+    im = Image.open(BytesIO(data))
+    im.draft("RGB", (256, 256))
+    im = im.convert("RGB").resize((256, 256), Image.BILINEAR)
     im.save(out_path, format="JPEG", quality=90, optimize=True)
 
+def get_thumb_pool() -> ProcessPoolExecutor:
+    global _THUMB_POOL
+    if _THUMB_POOL is None:
+        # The browser and HTTP client run threads by the time this is created; forking
+        # a multi-threaded process can deadlock the child, so start workers from a forkserver
+        _THUMB_POOL = ProcessPoolExecutor(max_workers=max(2, (os.cpu_count() or 1) - 1),
+                                          mp_context=multiprocessing.get_context("forkserver"))
+    return _THUMB_POOL
+
 def extract_hashtags(txt: str) -> List[str]:
-    return re.findall(r"#([A-Za-z0-9_]+)", txt)
+    return HASHTAG_RE.findall(txt)
 
 async def fetch_top_comments(video, n: int = 5) -> List[str]:
+    # Min-heap of the n most-liked (likes, text) pairs seen so far
     comments = []
+    seen = 0
+
+    def keep(entry):
+        nonlocal seen
+        seen += 1
+        if len(comments) < n:
+            heapq.heappush(comments, entry)
+        else:
+            heapq.heappushpop(comments, entry)
+
     try:
         video_comments = video.comments(count=50)
         try:
             first_comment = await anext(video_comments)
             try:
-                comments.append((first_comment.as_dict["digg_count"] or 0, first_comment.text))
-                print(f"Added first comment with text: {first_comment.text[:30]}...")
+                keep((first_comment.as_dict["digg_count"] or 0, first_comment.text))
+                logger.debug("Added first comment with text: %.30s...", first_comment.text)
             except Exception as e:
-                print(f"Error processing first comment: {e}")
+                logger.warning("Error processing first comment: %s", e)
             async for c in video_comments:
                 try:
-                    comments.append((c.as_dict["digg_count"] or 0, c.text))
-                    # print(f"Added comment: {c.text[:30]}...")
+                    keep((c.as_dict["digg_count"] or 0, c.text))
                 except Exception as e:
-                    print(f"Error processing comment: {e}")
+                    logger.warning("Error processing comment: %s", e)
                     if hasattr(c, 'as_dict'):
-                        print(f"Comment structure: {c.as_dict}")
+                        logger.debug("Comment structure: %s", c.as_dict)
         
         except StopAsyncIteration:
-            print("❌ No comments available for this video")
+            logger.debug("No comments available for this video")
+        except OVERLOAD_EXCEPTIONS:
+            raise
         except Exception as e:
-            print(f"❌ Error when fetching first comment: {e}")
-            traceback.print_exc()
+            logger.exception("Error when fetching first comment: %s", e)
             
-        print(f"Total comments collected: {len(comments)}")
+        logger.debug("Total comments collected: %d", seen)
         
-        # Sort by like count if we have any comments
+        # Most-liked first
         if comments:
-            comments.sort(reverse=True)
-            return [c[1] for c in comments[:n]]
+            return [text for _, text in sorted(comments, reverse=True)]
         
+    except OVERLOAD_EXCEPTIONS:
+        raise
     except Exception as e:
-        print(f"Error in fetch_top_comments: {e}")
-        traceback.print_exc()
+        logger.exception("Error in fetch_top_comments: %s", e)
         
     return []
 
 def load_cookies_txt(filepath: str) -> dict:
-    cookies = {}
-    with open(filepath, "r") as f:
-        for line in f:
-            line = line.strip()
-            if not line or line.startswith("#"):
-                continue
-            parts = line.split("\t")
-            if len(parts) >= 7:
-                domain, flag, path, secure, expiry, name, value = parts
-                cookies[name] = value
-    return cookies
-
-def print_dataset_stats(df: pd.DataFrame) -> None:
-    """Print basic statistics about the dataset."""
-    print("\n----- Dataset Statistics -----")
-    print(f"Total videos: {len(df)}")
-
-def save_batch_to_parquet(rows: List[Dict], parquet_name: Path, batch_number: int) -> None:
-    """Save a batch of rows to the parquet file, either by creating a new file or updating existing one."""
-    if parquet_name.exists():
+    # MozillaCookieJar also handles #HttpOnly_ domains, which a plain "#" skip drops
+    jar = http.cookiejar.MozillaCookieJar(filepath)
+    try:
+        jar.load(ignore_discard=True, ignore_expires=True)
+    except http.cookiejar.LoadError as e:
+        logger.warning("Skipping cookie file %s: %s", filepath, e)
+        return {}
+    # The same name can be set on several domains (www.tiktok.com and .tiktok.com);
+    # keep the one that expires last
+    return {c.name: c.value for c in sorted(jar, key=lambda c: c.expires or 0)}
+
+def hashtags_column(descriptions: pa.ChunkedArray) -> pa.ChunkedArray:
+    """HASHTAG_RE.findall() over a whole column, run in Arrow's C++ regex kernels."""
+    # Keep "<tag> " for each hashtag and turn every other character into a space,
+    # then collapse the filler so each description becomes "tag1 tag2 ..."
+    spaced = pc.replace_substring_regex(descriptions, pattern=r"(?s)#([A-Za-z0-9_]+)|.", replacement=r"\1 ")
+    joined = pc.utf8_trim(pc.replace_substring_regex(spaced, pattern=" +", replacement=" "), characters=" ")
+    no_tags = pa.scalar([], type=SCHEMA.field("hashtags").type)
+    return pc.if_else(pc.equal(joined, ""), no_tags, pc.split_pattern(joined, pattern=" "))
+
+def write_rows(writer: Optional[pq.ParquetWriter], part_path: Path, rows: List[Dict]) -> pq.ParquetWriter:
+    """Append rows to this run's part file, opening the writer on first use."""
+    table = pa.Table.from_pylist(rows, schema=ROW_SCHEMA)
+    table = table.add_column(SCHEMA.get_field_index("hashtags"), SCHEMA.field("hashtags"),
+                             hashtags_column(table["description"]))
+    if writer is None:
+        writer = pq.ParquetWriter(part_path, SCHEMA, **PARQUET_OPTIONS)
+    writer.write_table(table, row_group_size=ROW_GROUP_SIZE)
+    return writer
+
+def migrate_legacy_dataset() -> int:
+    """Rewrite LEGACY_DATASET into PARTS_DIR in SCHEMA, then move it aside; returns rows migrated."""
+    if not LEGACY_DATASET.exists():
+        return 0
+    legacy = pq.read_table(LEGACY_DATASET)
+    columns = []
+    for field in SCHEMA:
+        if field.name == "hashtags":
+            column = hashtags_column(legacy["description"].cast(pa.string()))
+        elif field.name not in legacy.column_names:
+            column = pa.nulls(legacy.num_rows, field.type)
+        elif field.name == "posted_ts" and pa.types.is_floating(legacy[field.name].type):
+            # Legacy rows stored datetime.timestamp() floats
+            column = pc.floor(legacy[field.name]).cast(pa.int64()).cast(field.type)
+        else:
+            column = legacy[field.name].cast(field.type)
+        columns.append(column)
+    pq.write_table(pa.Table.from_arrays(columns, schema=SCHEMA), PARTS_DIR / "part-legacy.parquet",
+                   row_group_size=ROW_GROUP_SIZE, **PARQUET_OPTIONS)
+    # Moved out of OUT_DIR's top level so it is neither migrated nor read twice
+    archive = OUT_DIR / "legacy" / LEGACY_DATASET.name
+    archive.parent.mkdir(exist_ok=True)
+    LEGACY_DATASET.replace(archive)
+    return legacy.num_rows
+
+class TokenBucket:
+    """Shared request pacing: refills `rate` tokens per second up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: int = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+def pace_requests(api: TikTokApi, rate: TokenBucket) -> None:
+    """Take a token before every TikTok API call, so each feed page and comment page is paced."""
+    make_request = api.make_request
+
+    async def paced_make_request(*args, **kwargs):
+        await rate.acquire()
+        return await make_request(*args, **kwargs)
+
+    api.make_request = paced_make_request
+
+async def read_body(response: httpx.Response) -> bytearray:
+    """Read a streamed body into one buffer sized from Content-Length, skipping the chunk join."""
+    size = int(response.headers.get("Content-Length", 0))
+    if not size or response.headers.get("Content-Encoding"):
+        # Unknown or encoded length, let httpx assemble the body
+        return bytearray(await response.aread())
+    buf = bytearray(size)
+    pos = 0
+    with memoryview(buf) as view:
+        async for chunk in response.aiter_raw():
+            view[pos:pos + len(chunk)] = chunk  # raises if the body overruns Content-Length
+            pos += len(chunk)
+    if pos != size:
+        raise ValueError(f"Truncated body: got {pos} of {size} bytes")
+    return buf
+
+async def download_thumbnail(client: httpx.AsyncClient, cover_url: str, thumb_path: Path) -> bool:
+    async with client.stream("GET", cover_url, timeout=10.0) as response:
+        if response.status_code != 200:
+            logger.warning("Failed to download thumbnail %s: HTTP %d", cover_url, response.status_code)
+            return False
+        body = await read_body(response)
+    # PIL is blocking and CPU-bound, run it in the worker processes. The raw body is
+    # sent as-is (wrapping it in BytesIO here would copy it once more before pickling)
+    await asyncio.get_running_loop().run_in_executor(
+        get_thumb_pool(), resize_and_save, body, thumb_path
+    )
+    return True
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit: one more slot per window of successes, halved on rate limits."""
+
+    def __init__(self, initial: int, minimum: int, maximum: int):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self.successes = 0
+        self.cond = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self.cond:
+            await self.cond.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        async with self.cond:
+            self.in_flight -= 1
+            if exc_type is None:
+                self.successes += 1
+                if self.successes >= self.limit:
+                    self.limit = min(self.maximum, self.limit + 1)
+                    self.successes = 0
+            elif issubclass(exc_type, OVERLOAD_EXCEPTIONS):
+                self.limit = max(self.minimum, self.limit // 2)
+                self.successes = 0
+            self.cond.notify_all()
+        return False
+
+def clear_stale_claims() -> int:
+    """Delete thumbnail claims left by a crashed run so those videos are collected again."""
+    # *.jpg.part are unfinished claims; 0-byte *.jpg are claims from before they had their own file
+    stale = [*THUMBS_DIR.glob("*.jpg.part"), *(p for p in THUMBS_DIR.glob("*.jpg") if p.stat().st_size == 0)]
+    for path in stale:
+        path.unlink(missing_ok=True)
+    return len(stale)
+
+async def build_row(video, http_client: httpx.AsyncClient) -> Optional[Dict]:
+    """Build the row for one video; returns None when the video is skipped."""
+    # Basic metadata. as_dict is the payload TikTokApi already holds (not a copy);
+    # id/create_time/stats/author are the attributes it parsed out of it
+    videoDict = video.as_dict
+    logger.debug("Processing video %s posted at %s", video.id, video.create_time)
+
+    # video.stats is TikTok's statsV2 when present, which carries counts as strings
+    stats = {key: int(value) for key, value in video.stats.items() if key in STAT_KEYS}
+    author = video.author
+
+    row = {
+        "video_id"      : video.id,
+        "posted_ts"     : int(video.create_time.timestamp()),  # create_time is naive local time
+        "description"   : videoDict["desc"],
+        "author_id"     : author.user_id,
+        "author_name"   : author.username,
+        "follower_count": int(videoDict["authorStats"]["followerCount"]),
+        "view_count"    : stats["playCount"],
+        "like_count"    : stats["diggCount"],
+        "share_count"   : stats["shareCount"],
+        "comment_count" : stats["commentCount"],
+        "repost_count"  : stats["repostCount"],
+    }
+
+    cover_url = videoDict["video"]["cover"]
+    if not cover_url:
+        logger.warning("No cover URL found for video %s", video.id)
+        logger.debug("Video payload: %s", videoDict["video"])
+        return None
+
+    # Claim the thumbnail with an exclusive create of a .part file, so two tasks that
+    # see the same video can't both download it. The finished JPEG is renamed into
+    # place, so a crash leaves only the .part, which the next run clears
+    thumb_path = THUMBS_DIR / f"{video.id}.jpg"
+    claim_path = thumb_path.with_name(thumb_path.name + ".part")
+    try:
+        open(claim_path, "xb").close()
+    except FileExistsError:
+        logger.debug("Thumbnail for video %s is already being downloaded", video.id)
+        return None
+    if thumb_path.exists():
+        claim_path.unlink()
+        logger.debug("Thumbnail already exists for video %s", video.id)
+        return None
+
+    downloaded = False
+    try:
+        # Top 5 comments
+        logger.debug("Fetching top comments for video %s (has %d comments)", video.id, stats["commentCount"])
+
+        # Skip comment fetching if video has no comments to avoid wasting API calls
+        if stats["commentCount"] > 0:
+            row["top_comments"] = await fetch_top_comments(video, n=5)
+        else:
+            logger.debug("Video %s has no comments according to stats, skipping comment fetch", video.id)
+            row["top_comments"] = []
+
+        # Thumbnail
         try:
-            # Load existing data
-            existing_df = pd.read_parquet(parquet_name)
-            print(f"Loaded existing dataset with {len(existing_df)} rows")
-            
-            # Convert new rows to DataFrame
-            new_df = pd.DataFrame(rows)
-            print(f"Batch {batch_number}: Adding {len(new_df)} new rows")
-            
-            # Check for duplicates by video_id
-            existing_video_ids = set(existing_df['video_id'].values)
-            new_df = new_df[~new_df['video_id'].isin(existing_video_ids)]
-            print(f"After removing duplicates, adding {len(new_df)} rows")
-            
-            # Concatenate and save if there are new rows to add
-            if len(new_df) > 0:
-                combined_df = pd.concat([existing_df, new_df], ignore_index=True)
-                combined_df.to_parquet(parquet_name, index=False)
-                print(f"✅ Updated dataset with {len(combined_df)} total rows (added {len(new_df)} new rows)")
-                print_dataset_stats(combined_df)
-                return len(combined_df)
-            else:
-                print("⚠️ No new unique rows to add to the dataset")
-                return len(existing_df)
-                
+            if await download_thumbnail(http_client, cover_url, claim_path):
+                os.replace(claim_path, thumb_path)
+                downloaded = True
         except Exception as e:
-            print(f"Error updating existing parquet file: {e}")
-            # If loading or updating fails, create a new file
-            new_df = pd.DataFrame(rows)
-            new_df.to_parquet(parquet_name, index=False)
-            print(f"✅ Created new dataset with {len(new_df)} rows after error with existing file")
-            return len(new_df)
-    else:
-        # First time creating the file
-        new_df = pd.DataFrame(rows)
-        new_df.to_parquet(parquet_name, index=False)
-        print(f"✅ Created new dataset with {len(new_df)} rows")
-        return len(new_df)
+            logger.warning("Thumbnail failed for video %s: %s", video.id, e)
+    finally:
+        # Release the claim so a retry (or the next run) can try this video again
+        if not downloaded:
+            claim_path.unlink(missing_ok=True)
+
+    if not downloaded:
+        return None
+    row["thumbnail_path"] = str(thumb_path)
+    return row
+
+async def process_video(video, limiter: AdaptiveLimiter, pbar,
+                        http_client: httpx.AsyncClient) -> Optional[Dict]:
+    """Build a video's row under the adaptive limiter, retrying when TikTok rate limits us."""
+    try:
+        for attempt in range(1, OVERLOAD_RETRIES + 1):
+            try:
+                async with limiter:
+                    return await build_row(video, http_client)
+            except OVERLOAD_EXCEPTIONS as e:
+                if attempt == OVERLOAD_RETRIES:
+                    raise
+                logger.warning("Rate limited on video %s (%s), concurrency now %d", video.id, e, limiter.limit)
+    finally:
+        pbar.update(1)
+
+@asynccontextmanager
+async def checkout_session(free_sessions: asyncio.Queue):
+    """Hold one free TikTok session index for the duration of a tag."""
+    session_index = await free_sessions.get()
+    try:
+        yield session_index
+    finally:
+        free_sessions.put_nowait(session_index)
+
+async def process_tag(api, search_term: str, free_sessions: asyncio.Queue,
+                      limiter: AdaptiveLimiter, http_client: httpx.AsyncClient, state: Dict) -> None:
+    """Collect one hashtag on its own TikTok session, writing each round into the shared part."""
+    async with checkout_session(free_sessions) as session_index:
+        if state["attempts"] >= REQUEST_CAP:
+            return
+        try:
+            # Create a progress bar
+            pbar = tqdm(total=VIDEOS_PER_TAG, desc=f"Processing {search_term}", position=session_index)
+
+            # Get the search results
+            tag = api.hashtag(name=search_term)
+            logger.info("Starting search for %s", search_term)
+
+            # Process the tag in rounds: collect up to the remaining quota of
+            # videos, then fan them out concurrently under the adaptive limiter
+            videos_processed = 0  # Counter for actually processed videos
+            videos_iter = tag.videos(count=VIDEOS_PER_TAG * 10, session_index=session_index).__aiter__()  # Request more to find suitable videos
+            exhausted = False
+            while not exhausted and videos_processed < VIDEOS_PER_TAG and state["attempts"] < REQUEST_CAP:
+                videos = []
+                wanted = min(VIDEOS_PER_TAG - videos_processed, BATCH_SIZE)
+                while len(videos) < wanted:
+                    try:
+                        video = await anext(videos_iter)
+                    except StopAsyncIteration:
+                        exhausted = True
+                        break
+                    # Other tags share the cap, so re-check it after every await
+                    if state["attempts"] >= REQUEST_CAP:
+                        break
+                    state["attempts"] += 1
+
+                    # Filter by timestamp before any as_dict/stats work is scheduled
+                    if SKIP_OLD_VIDEOS and int(video.create_time.timestamp()) < TIME_LIMIT:
+                        pbar.update(1)
+                        continue
+                    videos.append(video)
+
+                results = await asyncio.gather(
+                    *[process_video(v, limiter, pbar, http_client) for v in videos],
+                    return_exceptions=True,
+                )
+                rows: List[Dict] = []
+                for video, result in zip(videos, results):
+                    if isinstance(result, BaseException):
+                        logger.warning("Error processing video %s: %s", video.id, result)
+                    elif result is not None:
+                        rows.append(result)
+                # Update counter for successfully processed videos
+                videos_processed += len(rows)
+                state["total_processed"] += len(rows)
+
+                # Write the round out so memory stays bounded by one round of rows.
+                # write_rows never awaits, so tags can't interleave inside a write
+                if rows:
+                    state["batch_count"] += 1
+                    logger.info("Writing batch #%d with %d rows from %s", state["batch_count"], len(rows), search_term)
+                    state["writer"] = write_rows(state["writer"], state["part_path"], rows)
+
+            if videos_processed >= VIDEOS_PER_TAG:
+                logger.info("Reached target of %d videos for %s", VIDEOS_PER_TAG, search_term)
+            if state["attempts"] >= REQUEST_CAP:
+                logger.info("Reached request cap, stopping search")
+            pbar.close()
+        except Exception as e:
+            logger.error("Error processing search term %s: %s", search_term, e)
 
 async def main():
     ms_tokens = []
@@ -184,171 +530,64 @@ async def main():
         cookies = load_cookies_txt(cookie_file)
         if ms_token := cookies.get("msToken"):
             ms_tokens.append(ms_token)
-    print(ms_tokens)
+    logger.info("Loaded %d msTokens from %d cookie files", len(ms_tokens), len(cookie_files))
     if not ms_tokens:
-        print("Error: No msTokens found in any cookie files")
+        logger.error("No msTokens found in any cookie files")
         return
 
-    rows: List[Dict] = []
-    attempts = 0
-    total_processed = 0
-    batch_count = 0
-    parquet_name = OUT_DIR / "tiktok_beauty_dataset.parquet"
+    # Rows stream into this run's own part file, so nothing is re-read or rewritten.
+    # Videos collected by earlier runs are already skipped by their thumbnail claim
+    PARTS_DIR.mkdir(parents=True, exist_ok=True)
+    if migrated := migrate_legacy_dataset():
+        logger.info("Migrated %d rows from %s into %s", migrated, LEGACY_DATASET, PARTS_DIR)
+    if cleared := clear_stale_claims():
+        logger.info("Cleared %d unfinished thumbnails from an earlier run", cleared)
+    state = {
+        "attempts": 0,
+        "total_processed": 0,
+        "batch_count": 0,
+        "part_path": PARTS_DIR / f"part-{dt.datetime.now(dt.timezone.utc):%Y%m%dT%H%M%SZ}.parquet",
+        "writer": None,
+    }
+    limiter = AdaptiveLimiter(INITIAL_CONCURRENCY, MIN_CONCURRENCY, MAX_CONCURRENCY)
+    rate = TokenBucket(REQUESTS_PER_SECOND, capacity=INITIAL_CONCURRENCY)
 
-    async with TikTokApi() as api:
-        await api.create_sessions(ms_tokens=ms_tokens, headless=False, num_sessions=3)
-        
-        for search_term in SEARCH_TERMS:
-            try:
-                # Create a progress bar
-                pbar = tqdm(total=VIDEOS_PER_TAG, desc=f"Processing {search_term}")
-                
-                # Get the search results
-                tag = api.hashtag(name=search_term)
-                print(f"Starting search for {search_term}")
-                
-                # try:
-                #     first_video = await anext(search_results)
-                #     print(f"✅ Successfully got a video: {first_video.id}")
-                # except StopAsyncIteration:
-                #     print("❌ search_results is EMPTY!")
-                # except Exception as e:
-                #     print(f"❌ Error when fetching first video: {e}")
-                #     traceback.print_exc()
-
-                # Process each video
-                videos_processed = 0  # Counter for actually processed videos
-                async for video in tag.videos(count=VIDEOS_PER_TAG * 10):  # Request more to find suitable videos
-                    if attempts >= REQUEST_CAP:
-                        print("Reached request cap")
-                        break
-                    
-                    attempts += 1
-                    
-                    # Filter by timestamp - include videos from the last year
-                    # video_timestamp = video.create_time.timestamp()
-                    # if video_timestamp < TIME_LIMIT:
-                    #     print(f"Skipping video {video.id} - too old: {video.create_time}")
-                    #     pbar.update(1)
-                    #     continue
-
-                    # Basic metadata
-                    videoDict = video.as_dict
-                    print(f"Processing video {video.id} posted at {video.create_time}")
-
-                    stats = video.stats
-                    author = video.author
-                    authorStats = videoDict["authorStats"]
-                    # authorDict = author.as_dict
-                    # authorInfo = await author.info()
-
-                    # print("authorDict: ", json.dumps(authorDict, indent=4))
-                    # print("authorInfo: ", json.dumps(authorInfo, indent=4))
-                    
-                    row = {
-                        "video_id"      : video.id,
-                        "posted_ts"     : video.create_time.timestamp(),
-                        "description"   : videoDict["desc"],
-                        #"hashtags"      : extract_hashtags(videoDict["desc"]),
-                        "author_id"     : author.user_id,
-                        "author_name"   : author.username,
-                        "follower_count": authorStats["followerCount"],
-                        "view_count"    : stats["playCount"],
-                        "like_count"    : stats["diggCount"],
-                        "share_count"   : stats["shareCount"],
-                        "comment_count" : stats["commentCount"],
-                        "repost_count"  : stats["repostCount"],
-                    }
-                    
-                    # Thumbnail
-                    thumb_path = THUMBS_DIR / f"{video.id}.jpg"
-                    if not thumb_path.exists():   # avoid re-download
-                        try:
-                            # Get the URL from videoDict
-                            cover_url = videoDict["video"]["cover"]
-                            if(not cover_url or cover_url == ""):
-                                print(f"No cover URL found for video {video.id}")
-                                print(videoDict["video"])
-                                continue
-                                
-                            # Download the image
-                            response = requests.get(cover_url)
-                            if response.status_code == 200:
-                                resize_and_save(response.content, thumb_path)
-                            else:
-                                print(f"Failed to download thumbnail: HTTP {response.status_code}")
-                        except Exception as e:
-                            print(f"Thumbnail failed: {e}")
-                            pbar.update(1)
-                            continue
-                    else:
-                        print(f"Thumbnail already exists for video {video.id}")
-                        continue
-                    
-                    row["thumbnail_path"] = str(thumb_path)
-
-                    # Top 5 comments
-                    print(f"Fetching top comments for video {video.id} (has {stats.get('commentCount', 0)} comments)")
-                    
-                    # Skip comment fetching if video has no comments to avoid wasting API calls
-                    if int(stats.get('commentCount', 0)) > 0:
-                        try:
-                            row["top_comments"] = await fetch_top_comments(video, n=5)
-                        except Exception as e:
-                            #continue
-                            print(f"Error fetching top comments for video {video.id}: {e}")
-                    else:
-                        print(f"Video {video.id} has no comments according to stats, skipping comment fetch")
-                        row["top_comments"] = []
-                        
-                    rows.append(row)
-
-                    # Update counter for successfully processed videos
-                    videos_processed += 1
-                    total_processed += 1
-                    
-                    # Check if we need to save a batch
-                    if len(rows) >= BATCH_SIZE:
-                        batch_count += 1
-                        print(f"\n💾 Saving batch #{batch_count} with {len(rows)} rows...")
-                        save_batch_to_parquet(rows, parquet_name, batch_count)
-                        rows = []  # Clear the rows after saving
-                    
-                    # Break if we've processed the requested number of videos
-                    if videos_processed >= VIDEOS_PER_TAG:
-                        print(f"Reached target of {VIDEOS_PER_TAG} videos for {search_term}")
-                        break
-                        
-                    # polite spacing
-                    await asyncio.sleep(random.uniform(2, 4))
-                    if attempts % 20 == 0:
-                        await asyncio.sleep(10)
-                    
-                    pbar.update(1)
-
-                pbar.close()
-                if attempts >= REQUEST_CAP:
-                    print("Reached request cap, stopping search")
-                    break
-            except Exception as e:
-                print(f"Error processing search term {search_term}: {e}")
-                continue
-                
-    # Save any remaining rows
-    if rows:
-        batch_count += 1
-        print(f"\n💾 Saving final batch #{batch_count} with {len(rows)} remaining rows...")
-        save_batch_to_parquet(rows, parquet_name, batch_count)
-    
-    print(f"\n🎉 Data collection complete! Processed {total_processed} videos in {batch_count} batches.")
+    try:
+        # One pooled client for every cover download, so fetches reuse connections to the CDN
+        async with TikTokApi() as api, httpx.AsyncClient(
+            http2=True, limits=httpx.Limits(max_connections=128, max_keepalive_connections=32)
+        ) as http_client:
+            num_sessions = min(len(ms_tokens), NUM_SESSIONS)
+            await api.create_sessions(ms_tokens=ms_tokens, headless=False, num_sessions=num_sessions)
+            pace_requests(api, rate)
+
+            # One tag per session at a time: a tag checks a free session out and returns it
+            # when done. The limiter and token bucket are shared so the extra tags add no
+            # load beyond the global budget
+            free_sessions: asyncio.Queue = asyncio.Queue()
+            for session_index in range(num_sessions):
+                free_sessions.put_nowait(session_index)
+            await asyncio.gather(*[
+                process_tag(api, search_term, free_sessions, limiter, http_client, state)
+                for search_term in SEARCH_TERMS
+            ])
+    finally:
+        # Closing writes the footer, so a crash still leaves a readable part
+        if state["writer"] is not None:
+            state["writer"].close()
+        if _THUMB_POOL is not None:
+            _THUMB_POOL.shutdown()
+
+    logger.info("Data collection complete! Processed %d videos in %d batches.",
+                state["total_processed"], state["batch_count"])
     
-    # Print final stats if file exists
-    if parquet_name.exists():
-        final_df = pd.read_parquet(parquet_name)
-        print("\n----- Final Dataset Statistics -----")
-        print(f"Total videos in dataset: {len(final_df)}")
+    # Print final stats if this run wrote a part
+    if state["writer"] is not None:
+        part_path = state["part_path"]
+        logger.info("Videos written to %s: %d", part_path, pq.read_metadata(part_path).num_rows)
+        logger.info("Total videos in dataset: %d", sum(pq.read_metadata(p).num_rows for p in PARTS_DIR.glob("*.parquet")))
     else:
-        print("❌ No matching videos were found and saved. Try again later!")
+        logger.warning("No matching videos were found and saved. Try again later!")
 
 if __name__ == "__main__":
     asyncio.run(main())
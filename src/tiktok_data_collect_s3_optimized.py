@@ -5,25 +5,42 @@ This version removes heavy dependencies like Playwright and optimizes for Lambda
 """
 
 import os
+import sys
 import re
 import json
 import time
 import random
 import datetime as dt
 import asyncio
+import atexit
+import multiprocessing
+import signal
+import heapq
+from contextlib import asynccontextmanager
 from io import BytesIO
-import traceback
-from typing import List, Dict, Optional
+import logging
+import uuid
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, Dict, NamedTuple, Optional, Set
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 from PIL import Image
 import boto3
+from boto3.s3.transfer import TransferConfig, create_transfer_manager
+from botocore.config import Config
 from botocore.exceptions import ClientError
 from TikTokApi import TikTokApi
-import requests
+import httpx
 
 # ---------- AWS Configuration ----------
 S3_BUCKET = os.environ.get('S3_BUCKET', 'socialmediaanalyzer')
-S3_DATA_KEY = 'raw/data/tiktok_data.parquet'
+S3_DATA_KEY = 'raw/data/tiktok_data.parquet'       # legacy single-file dataset
+S3_PARTS_PREFIX = 'raw/data/parts/'                  # one parquet file per saved batch
+S3_SEEN_IDS_KEY = 'raw/data/seen_video_ids.json'     # video_ids already written, for dedup
+S3_LEGACY_PART_KEY = 'raw/data/parts/part-legacy.parquet'  # legacy dataset cast to BATCH_SCHEMA
+S3_LEGACY_ARCHIVE_KEY = 'raw/data/legacy/tiktok_data.parquet'  # legacy file after migration
 S3_THUMBNAILS_PREFIX = 'raw/thumbnails/'
 AWS_REGION = os.environ.get('AWS_REGION', 'ap-northeast-2')
 
@@ -62,88 +79,260 @@ VIDEOS_PER_TAG = int(os.environ.get('VIDEOS_PER_TAG', '30'))  # Further reduced
 REQUEST_CAP = int(os.environ.get('REQUEST_CAP', '150'))       # Reduced for Lambda
 BATCH_SIZE = int(os.environ.get('BATCH_SIZE', '20'))          # Smaller batches
 MAX_EXECUTION_TIME = int(os.environ.get('MAX_EXECUTION_TIME', '840'))  # 14 minutes (Lambda timeout buffer)
+THUMBNAIL_CONCURRENCY = int(os.environ.get('THUMBNAIL_CONCURRENCY', '16'))  # Parallel cover downloads
+NUM_SESSIONS = int(os.environ.get('NUM_SESSIONS', '8'))  # Browser sessions, capped by the MS tokens available
+THUMBNAIL_SIZE = (256, 256)
+MAX_COVER_PIXELS = 4096 * 4096  # Reject anything bigger before decoding; TikTok covers are ~720x1280
+HASHTAG_RE = re.compile(r"#([A-Za-z0-9_]+)")  # Compiled once; used for every description
+VIDEO_TASK_TIMEOUT = float(os.environ.get('VIDEO_TASK_TIMEOUT', '15'))  # Cap on one video's comment fetch
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'WARNING')                # DEBUG shows per-video/comment messages
 
-# Initialize S3 client
-s3_client = boto3.client('s3', region_name=AWS_REGION)
+# Lambda already attaches a handler to the root logger; basicConfig only matters locally
+logging.basicConfig(level=LOG_LEVEL)
+logger = logging.getLogger(__name__)
+logger.setLevel(LOG_LEVEL)
 
-def print_progress(message: str, current: int = None, total: int = None):
-    """Simple progress printer for Lambda (replaces tqdm)."""
+# Column types for the parquet parts, fixed up front so every batch matches the writer.
+# Counts and epoch seconds fit in uint32 (view counts top out in the low billions, epoch
+# seconds until 2106), half the bytes of int64; out-of-range values fail the cast loudly
+BATCH_SCHEMA = pa.schema([
+    ('video_id', pa.string()),
+    ('posted_ts', pa.uint32()),
+    ('description', pa.string()),
+    ('author_id', pa.string()),
+    ('author_name', pa.string()),
+    ('follower_count', pa.uint32()),
+    ('view_count', pa.uint32()),
+    ('like_count', pa.uint32()),
+    ('share_count', pa.uint32()),
+    ('comment_count', pa.uint32()),
+    ('repost_count', pa.uint32()),
+    ('thumbnail_s3_key', pa.string()),
+    ('top_comments', pa.list_(pa.string())),
+])
+
+class TikTokRow(NamedTuple):
+    """One collected video, in BATCH_SCHEMA column order."""
+    video_id: str
+    posted_ts: int
+    description: str
+    author_id: str
+    author_name: str
+    follower_count: int
+    view_count: int
+    like_count: int
+    share_count: int
+    comment_count: int
+    repost_count: int
+    thumbnail_s3_key: str
+    top_comments: List[str]
+
+# Initialize S3 client; the pool covers THUMBNAIL_CONCURRENCY uploads plus the parquet/sidecar writes
+s3_client = boto3.client('s3', region_name=AWS_REGION, config=Config(max_pool_connections=32))
+# Thumbnail uploads share the transfer manager's worker threads and the client's connection pool
+s3_transfer = create_transfer_manager(s3_client, TransferConfig(max_concurrency=THUMBNAIL_CONCURRENCY))
+
+# Thumbnail keys already in S3, refreshed once per invocation by load_existing_thumbnail_keys()
+EXISTING_THUMBS: Set[str] = set()
+
+# video_ids already in the dataset, refreshed once per invocation by load_seen_video_ids().
+# Kept as an Arrow-backed Index so isin() runs in the pandas hashtable, not over Python objects
+VIDEO_ID_DTYPE = 'string[pyarrow]'
+SEEN_VIDEO_IDS: pd.Index = pd.Index([], dtype=VIDEO_ID_DTYPE)
+
+# This invocation's parquet part; see write_batch_to_part() / upload_part_to_s3()
+_PART_SINK: Optional[pa.BufferOutputStream] = None
+_PART_WRITER: Optional[pq.ParquetWriter] = None
+
+# Created lazily by get_resize_pool()
+_RESIZE_POOL: Optional[Executor] = None
+
+# Kept across warm invocations so the headless browser only starts on a cold start.
+# Playwright is bound to the loop that launched it, so the loop is reused as well
+_LOOP: Optional[asyncio.AbstractEventLoop] = None
+_API: Optional[TikTokApi] = None
+_API_LOCK: Optional[asyncio.Lock] = None  # created on _LOOP by get_tiktok_api()
+_SHUTDOWN_HOOKS_INSTALLED = False  # see install_shutdown_hooks()
+
+def log_progress(message: str, current: int = None, total: int = None):
+    """Simple progress logger for Lambda (replaces tqdm)."""
     if current is not None and total is not None:
-        percentage = (current / total) * 100
-        print(f"{message} [{current}/{total}] ({percentage:.1f}%)")
+        logger.info("%s [%d/%d] (%.1f%%)", message, current, total, current / total * 100)
     else:
-        print(message)
+        logger.info(message)
 
-def resize_and_save_to_s3(img_bytes: bytes, s3_key: str) -> bool:
-    """Resize image and upload directly to S3."""
+def resize_thumbnail(img_bytes: bytes) -> Optional[bytes]:
+    """Turn a cover image into 256x256 JPEG bytes, or None if it can't be used.
+
+    Pure bytes-in/bytes-out so it can run in the resize process pool.
+    JPEG covers are decoded at a reduced DCT scale via draft(); PNG/WebP
+    covers ignore the hint and fall back to a full decode. Image.open() only
+    parses the header, so covers are sized up before any pixels are decoded:
+    oversized ones are rejected and 256x256 JPEGs are returned as-is.
+    """
     try:
-        # Resize image
-        im = Image.open(BytesIO(img_bytes)).convert("RGB")
-        im = im.resize((256, 256), Image.LANCZOS)
+        im = Image.open(BytesIO(img_bytes))  # BytesIO shares the bytes object until written to
+        width, height = im.size
+        if width * height > MAX_COVER_PIXELS:
+            logger.warning("Rejecting oversized cover: %dx%d", width, height)
+            return None
+        
+        if im.format == "JPEG" and im.size == THUMBNAIL_SIZE:
+            # Already a thumbnail; skip the decode/LANCZOS/encode round trip
+            return img_bytes
+        
+        # Shrink-on-load, then resize (no copy() in between, it forces a full decode).
+        # reducing_gap box-reduces covers that are still >= 3x the target (PNG/WebP skip
+        # draft) before LANCZOS runs over the smaller image
+        im.draft("RGB", THUMBNAIL_SIZE)
+        im = im.convert("RGB").resize(THUMBNAIL_SIZE, Image.LANCZOS, reducing_gap=3.0)
         
-        # Save to BytesIO buffer
         buffer = BytesIO()
         im.save(buffer, format="JPEG", quality=90, optimize=True)
-        buffer.seek(0)
-        
-        # Upload to S3
-        s3_client.put_object(
-            Bucket=S3_BUCKET,
-            Key=s3_key,
-            Body=buffer.getvalue(),
-            ContentType='image/jpeg'
-        )
+        return buffer.getvalue()
+    except Exception as e:
+        logger.error("Error resizing image: %s", e)
+        return None
+
+def upload_thumbnail_to_s3(thumbnail: bytes, s3_key: str) -> bool:
+    """Upload resized thumbnail bytes through the transfer manager and record the key in the cache."""
+    try:
+        s3_transfer.upload(
+            BytesIO(thumbnail), S3_BUCKET, s3_key, extra_args={'ContentType': 'image/jpeg'}
+        ).result()
+        EXISTING_THUMBS.add(s3_key)
         return True
     except Exception as e:
-        print(f"Error uploading image to S3: {e}")
+        logger.error("Error uploading image %s to S3: %s", s3_key, e)
         return False
 
-def check_s3_object_exists(s3_key: str) -> bool:
-    """Check if an object exists in S3."""
+def resize_and_save_to_s3(img_bytes: bytes, s3_key: str) -> bool:
+    """Resize image and upload directly to S3."""
+    thumbnail = resize_thumbnail(img_bytes)
+    return thumbnail is not None and upload_thumbnail_to_s3(thumbnail, s3_key)
+
+def get_resize_pool() -> Executor:
+    """Worker pool for thumbnail resizes, created once and reused by warm invocations.
+
+    Processes sidestep the GIL for the Pillow work. Lambda has no /dev/shm, which
+    multiprocessing's locks need, so fall back to threads when the pool can't start.
+    """
+    global _RESIZE_POOL
+    if _RESIZE_POOL is None:
+        workers = os.cpu_count() or 1
+        try:
+            # boto3 and the browser have threads running by now; forking a multi-threaded
+            # process can deadlock the child, so start workers from a forkserver
+            _RESIZE_POOL = ProcessPoolExecutor(max_workers=workers,
+                                               mp_context=multiprocessing.get_context("forkserver"))
+        except OSError as e:
+            logger.warning("Process pool unavailable (%s), resizing thumbnails on threads", e)
+            _RESIZE_POOL = ThreadPoolExecutor(max_workers=workers)
+    return _RESIZE_POOL
+
+def load_existing_thumbnail_keys() -> int:
+    """Cache all thumbnail keys with one paginated LIST instead of a HEAD per video."""
+    EXISTING_THUMBS.clear()
     try:
-        s3_client.head_object(Bucket=S3_BUCKET, Key=s3_key)
-        return True
+        paginator = s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=S3_THUMBNAILS_PREFIX):
+            EXISTING_THUMBS.update(obj['Key'] for obj in page.get('Contents', []))
     except ClientError as e:
-        if e.response['Error']['Code'] == '404':
-            return False
-        else:
-            print(f"Error checking S3 object: {e}")
-            return False
+        logger.error("Error listing thumbnails in S3: %s", e)
+    return len(EXISTING_THUMBS)
+
+def check_s3_object_exists(s3_key: str) -> bool:
+    """Check if a thumbnail exists in S3 using the cached key listing."""
+    return s3_key in EXISTING_THUMBS
 
-def load_existing_parquet_from_s3() -> Optional[pd.DataFrame]:
-    """Load existing parquet file from S3."""
+def load_existing_parquet_from_s3(columns: Optional[List[str]] = None) -> Optional[pd.DataFrame]:
+    """Load the legacy single-file parquet dataset from S3."""
     try:
         response = s3_client.get_object(Bucket=S3_BUCKET, Key=S3_DATA_KEY)
-        return pd.read_parquet(BytesIO(response['Body'].read()))
+        return pd.read_parquet(BytesIO(response['Body'].read()), columns=columns)
     except ClientError as e:
         if e.response['Error']['Code'] == 'NoSuchKey':
-            print("No existing parquet file found in S3")
+            logger.info("No existing parquet file found in S3")
             return None
         else:
-            print(f"Error loading parquet from S3: {e}")
+            logger.error("Error loading parquet from S3: %s", e)
             return None
 
-def save_parquet_to_s3(df: pd.DataFrame) -> bool:
-    """Save dataframe to S3 as parquet."""
+def load_seen_video_ids() -> int:
+    """Load the dedup sidecar, seeding it from the legacy parquet file on first run."""
+    global SEEN_VIDEO_IDS
+    video_ids = []
+    try:
+        response = s3_client.get_object(Bucket=S3_BUCKET, Key=S3_SEEN_IDS_KEY)
+        video_ids = json.loads(response['Body'].read())
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'NoSuchKey':
+            logger.error("Error loading seen video ids from S3: %s", e)
+        else:
+            legacy_df = load_existing_parquet_from_s3(columns=['video_id'])
+            if legacy_df is not None:
+                video_ids = legacy_df['video_id']
+    SEEN_VIDEO_IDS = pd.Index(video_ids, dtype=VIDEO_ID_DTYPE).unique()
+    return len(SEEN_VIDEO_IDS)
+
+def save_seen_video_ids() -> bool:
+    """Write the dedup sidecar back to S3."""
     try:
-        buffer = BytesIO()
-        df.to_parquet(buffer, index=False)
-        buffer.seek(0)
-        
         s3_client.put_object(
             Bucket=S3_BUCKET,
-            Key=S3_DATA_KEY,
-            Body=buffer.getvalue(),
-            ContentType='application/octet-stream'
+            Key=S3_SEEN_IDS_KEY,
+            Body=json.dumps(SEEN_VIDEO_IDS.tolist()),
+            ContentType='application/json'
         )
         return True
     except Exception as e:
-        print(f"Error uploading parquet to S3: {e}")
+        logger.error("Error uploading seen video ids to S3: %s", e)
         return False
 
+def cast_to_batch_schema(table: pa.Table) -> pa.Table:
+    """Cast a legacy table (float posted_ts, int64 counts) to BATCH_SCHEMA; missing columns become null."""
+    columns = []
+    for field in BATCH_SCHEMA:
+        if field.name not in table.column_names:
+            columns.append(pa.nulls(table.num_rows, field.type))
+            continue
+        column = table.column(field.name)
+        if field.name == 'posted_ts' and pa.types.is_floating(column.type):
+            column = pc.floor(column)  # legacy rows stored datetime.timestamp()
+        columns.append(column.cast(field.type))
+    return pa.Table.from_arrays(columns, schema=BATCH_SCHEMA)
+
+def migrate_legacy_parquet() -> int:
+    """Move the legacy single-file dataset into parts/ once, archiving the original."""
+    global SEEN_VIDEO_IDS
+    legacy_df = load_existing_parquet_from_s3()
+    if legacy_df is None:
+        return 0
+    try:
+        table = cast_to_batch_schema(pa.Table.from_pandas(legacy_df, preserve_index=False))
+        sink = pa.BufferOutputStream()
+        pq.write_table(table, sink, compression='zstd', compression_level=3)
+        s3_client.put_object(
+            Bucket=S3_BUCKET,
+            Key=S3_LEGACY_PART_KEY,
+            Body=pa.BufferReader(sink.getvalue()),
+            ContentType='application/octet-stream'
+        )
+        # The sidecar must cover the legacy ids before the file it was seeded from moves
+        SEEN_VIDEO_IDS = SEEN_VIDEO_IDS.union(pd.Index(legacy_df['video_id'], dtype=VIDEO_ID_DTYPE))
+        if not save_seen_video_ids():
+            return 0
+        s3_client.copy_object(Bucket=S3_BUCKET, Key=S3_LEGACY_ARCHIVE_KEY,
+                              CopySource={'Bucket': S3_BUCKET, 'Key': S3_DATA_KEY})
+        s3_client.delete_object(Bucket=S3_BUCKET, Key=S3_DATA_KEY)
+        return table.num_rows
+    except Exception as e:
+        logger.exception("Error migrating legacy parquet into parts: %s", e)
+        return 0
+
 def extract_hashtags(txt: str) -> List[str]:
     """Extract hashtags from text."""
-    return re.findall(r"#([A-Za-z0-9_]+)", txt)
+    return HASHTAG_RE.findall(txt)
 
 async def fetch_top_comments(video, n: int = 3) -> List[str]:
     """Fetch top comments for a video (reduced to 3 for performance)."""
@@ -154,9 +343,9 @@ async def fetch_top_comments(video, n: int = 3) -> List[str]:
             first_comment = await anext(video_comments)
             try:
                 comments.append((first_comment.as_dict["digg_count"] or 0, first_comment.text))
-                print(f"Added first comment with text: {first_comment.text[:30]}...")
+                logger.debug("Added first comment with text: %.30s...", first_comment.text)
             except Exception as e:
-                print(f"Error processing first comment: {e}")
+                logger.debug("Error processing first comment: %s", e)
             
             async for c in video_comments:
                 try:
@@ -164,24 +353,56 @@ async def fetch_top_comments(video, n: int = 3) -> List[str]:
                     if len(comments) >= n * 2:  # Get a few extra to sort
                         break
                 except Exception as e:
-                    print(f"Error processing comment: {e}")
+                    logger.debug("Error processing comment: %s", e)
         
         except StopAsyncIteration:
-            print("❌ No comments available for this video")
+            logger.debug("No comments available for this video")
         except Exception as e:
-            print(f"❌ Error when fetching first comment: {e}")
+            logger.warning("Error when fetching first comment: %s", e)
             
-        print(f"Total comments collected: {len(comments)}")
+        logger.debug("Total comments collected: %d", len(comments))
         
         if comments:
-            comments.sort(reverse=True)
-            return [c[1] for c in comments[:n]]
+            # Partial top-k; a full sort would order the tail we throw away
+            return [text for _, text in heapq.nlargest(n, comments)]
         
     except Exception as e:
-        print(f"Error in fetch_top_comments: {e}")
+        logger.warning("Error in fetch_top_comments: %s", e)
         
     return []
 
+async def fetch_and_upload(client: httpx.AsyncClient, semaphore: asyncio.Semaphore,
+                           video_id: str, cover_url: str, s3_key: str) -> bool:
+    """Download a cover image, resize it in the worker pool and upload it to S3."""
+    async with semaphore:
+        try:
+            response = await client.get(cover_url, timeout=5.0)
+            if response.status_code != 200:
+                logger.warning("Failed to download thumbnail for video %s: HTTP %d", video_id, response.status_code)
+                return False
+            img_bytes = response.content
+        except Exception as e:
+            logger.warning("Thumbnail download failed for video %s: %s", video_id, e)
+            return False
+
+    # Pillow is CPU-bound (process pool) and boto3 is blocking I/O (default thread pool);
+    # keep both off the event loop
+    loop = asyncio.get_running_loop()
+    try:
+        thumbnail = await loop.run_in_executor(get_resize_pool(), resize_thumbnail, img_bytes)
+    except Exception as e:
+        logger.warning("Thumbnail resize failed for video %s: %s", video_id, e)
+        return False
+    if thumbnail is None or not await loop.run_in_executor(None, upload_thumbnail_to_s3, thumbnail, s3_key):
+        logger.warning("Failed to upload thumbnail for video %s", video_id)
+        return False
+    return True
+
+async def resolve_pending_thumbnails(pending: List[Dict]) -> List[TikTokRow]:
+    """Wait for the pending thumbnail uploads and return the rows whose upload succeeded."""
+    results = await asyncio.gather(*[item["upload"] for item in pending])
+    return [item["row"] for item, uploaded in zip(pending, results) if uploaded]
+
 def load_cookies_from_env() -> List[str]:
     """Load MS tokens from environment variables."""
     ms_tokens = []
@@ -204,57 +425,269 @@ def load_cookies_from_env() -> List[str]:
     
     return ms_tokens
 
-def print_dataset_stats(df: pd.DataFrame) -> None:
-    """Print basic statistics about the dataset."""
-    print("\n----- Dataset Statistics -----")
-    print(f"Total videos: {len(df)}")
+def write_batch_to_part(rows: List[TikTokRow], batch_number: int) -> int:
+    """Append a deduplicated batch as a row group of this invocation's parquet part.
 
-def save_batch_to_s3(rows: List[Dict], batch_number: int) -> int:
-    """Save a batch of rows to S3, merging with existing data."""
+    The part is streamed through one ParquetWriter for the whole invocation, so
+    only the current batch is ever held in memory; upload_part_to_s3() ships it
+    once collection finishes. Readers load raw/data/parts/ as one dataset.
+    """
+    global SEEN_VIDEO_IDS, _PART_SINK, _PART_WRITER
     try:
-        # Load existing data from S3
-        existing_df = load_existing_parquet_from_s3()
+        logger.info("Batch %d: Adding %d new rows", batch_number, len(rows))
         
-        if existing_df is not None:
-            print(f"Loaded existing dataset with {len(existing_df)} rows")
-            
-            # Convert new rows to DataFrame
-            new_df = pd.DataFrame(rows)
-            print(f"Batch {batch_number}: Adding {len(new_df)} new rows")
-            
-            # Check for duplicates by video_id
-            existing_video_ids = set(existing_df['video_id'].values)
-            new_df = new_df[~new_df['video_id'].isin(existing_video_ids)]
-            print(f"After removing duplicates, adding {len(new_df)} rows")
+        # Check for duplicates by video_id (the same video often shows up under several tags)
+        video_ids = pd.Index([row.video_id for row in rows], dtype=VIDEO_ID_DTYPE)
+        keep = ~video_ids.duplicated() & ~video_ids.isin(SEEN_VIDEO_IDS)
+        new_rows = [row for row, is_new in zip(rows, keep) if is_new]
+        logger.info("After removing duplicates, adding %d rows", len(new_rows))
+        
+        if not new_rows:
+            logger.info("No new unique rows to add to the dataset")
+            return len(SEEN_VIDEO_IDS)
+        
+        # Tuples transpose straight into typed Arrow columns; no per-row dicts or dtype inference
+        columns = [pa.array(values, type=field.type) for values, field in zip(zip(*new_rows), BATCH_SCHEMA)]
+        table = pa.Table.from_arrays(columns, schema=BATCH_SCHEMA)
+        
+        if _PART_WRITER is None:
+            _PART_SINK = pa.BufferOutputStream()
+            # zstd is ~7% smaller than the default snappy at similar write speed; pyarrow
+            # already dictionary-encodes every column (repeated author/hashtag text)
+            _PART_WRITER = pq.ParquetWriter(_PART_SINK, BATCH_SCHEMA, compression='zstd', compression_level=3)
+        _PART_WRITER.write_table(table)
+        
+        SEEN_VIDEO_IDS = SEEN_VIDEO_IDS.append(video_ids[keep])
+        return len(SEEN_VIDEO_IDS)
+                
+    except Exception as e:
+        logger.exception("Error writing batch %d: %s", batch_number, e)
+        return 0
+
+def upload_part_to_s3() -> bool:
+    """Close this invocation's parquet part, upload it and persist the dedup sidecar."""
+    global _PART_SINK, _PART_WRITER
+    if _PART_WRITER is None:
+        return True
+    try:
+        _PART_WRITER.close()
+        part_key = f"{S3_PARTS_PREFIX}part-{uuid.uuid4().hex}.parquet"
+        s3_client.put_object(
+            Bucket=S3_BUCKET,
+            Key=part_key,
+            Body=pa.BufferReader(_PART_SINK.getvalue()),  # zero-copy view of the part
+            ContentType='application/octet-stream'
+        )
+        save_seen_video_ids()
+        logger.info("Wrote %s (%d videos in dataset)", part_key, len(SEEN_VIDEO_IDS))
+        return True
+    except Exception as e:
+        logger.exception("Error uploading parquet to S3: %s", e)
+        return False
+    finally:
+        _PART_SINK = _PART_WRITER = None
+
+@asynccontextmanager
+async def checkout_session(free_sessions: asyncio.Queue):
+    """Hold one free TikTok session index for the duration of a tag."""
+    session_index = await free_sessions.get()
+    try:
+        yield session_index
+    finally:
+        free_sessions.put_nowait(session_index)
+
+async def process_tag(api, search_term: str, free_sessions: asyncio.Queue,
+                      http_client: httpx.AsyncClient, thumbnail_semaphore: asyncio.Semaphore,
+                      state: Dict, queue: asyncio.Queue) -> None:
+    """Collect one hashtag on its own TikTok session and push finished rows onto the queue."""
+    async with checkout_session(free_sessions) as session_index:
+        # Check remaining time
+        if time.time() - state['start_time'] > MAX_EXECUTION_TIME:
+            logger.warning("Approaching Lambda timeout, skipping search for %s", search_term)
+            return
+        if state['attempts'] >= REQUEST_CAP:
+            return
+
+        pending: List[Dict] = []  # rows waiting on their thumbnail upload
+        try:
+            log_progress(f"Starting search for {search_term}", SEARCH_TERMS.index(search_term) + 1, len(SEARCH_TERMS))
+            tag = api.hashtag(name=search_term)
             
-            # Concatenate and save if there are new rows to add
-            if len(new_df) > 0:
-                combined_df = pd.concat([existing_df, new_df], ignore_index=True)
-                if save_parquet_to_s3(combined_df):
-                    print(f"✅ Updated S3 dataset with {len(combined_df)} total rows (added {len(new_df)} new rows)")
-                    print_dataset_stats(combined_df)
-                    return len(combined_df)
+            videos_processed = 0
+            async for video in tag.videos(count=VIDEOS_PER_TAG * 2, session_index=session_index):
+                # Time check
+                if time.time() - state['start_time'] > MAX_EXECUTION_TIME:
+                    logger.warning("Time limit reached, stopping collection")
+                    break
+                    
+                if state['attempts'] >= REQUEST_CAP:
+                    logger.warning("Reached request cap")
+                    break
+                
+                state['attempts'] += 1
+                
+                # Basic metadata
+                videoDict = video.as_dict
+                logger.debug("Processing video %s posted at %s", video.id, video.create_time)
+
+                stats = video.stats
+                author = video.author
+                authorStats = videoDict["authorStats"]
+                
+                # Thumbnail S3 key
+                thumbnail_s3_key = f"{S3_THUMBNAILS_PREFIX}{video.id}.jpg"
+                
+                # Handle thumbnail (skip if exists) - uploads run in the background and are collected per batch
+                upload = None
+                if not check_s3_object_exists(thumbnail_s3_key):
+                    cover_url = videoDict["video"]["cover"]
+                    if not cover_url:
+                        logger.warning("No cover URL found for video %s", video.id)
+                        continue
+                    # Start the upload now so it overlaps this video's comment fetch (and later videos)
+                    upload = asyncio.create_task(fetch_and_upload(
+                        http_client, thumbnail_semaphore, video.id, cover_url, thumbnail_s3_key
+                    ))
                 else:
-                    print("❌ Failed to save updated dataset to S3")
-                    return len(existing_df)
-            else:
-                print("⚠️ No new unique rows to add to the dataset")
-                return len(existing_df)
+                    logger.debug("Thumbnail already exists in S3 for video %s", video.id)
                 
-        else:
-            # First time creating the file
-            new_df = pd.DataFrame(rows)
-            if save_parquet_to_s3(new_df):
-                print(f"✅ Created new S3 dataset with {len(new_df)} rows")
-                return len(new_df)
-            else:
-                print("❌ Failed to create new dataset in S3")
-                return 0
+                # Top comments (reduced to 3 and skip if no comments)
+                comment_count = int(stats.get('commentCount', 0))
+                if comment_count > 0:
+                    try:
+                        top_comments = await asyncio.wait_for(fetch_top_comments(video, n=3),
+                                                              timeout=VIDEO_TASK_TIMEOUT)
+                    except Exception as e:
+                        logger.warning("Error fetching top comments for video %s: %s", video.id, e)
+                        top_comments = []
+                else:
+                    top_comments = []
+                
+                row = TikTokRow(
+                    video.id,
+                    int(video.create_time.timestamp()),
+                    videoDict["desc"],
+                    author.user_id,
+                    author.username,
+                    # video.stats is TikTok's statsV2 when present, which carries counts as strings
+                    int(authorStats["followerCount"]),
+                    int(stats["playCount"]),
+                    int(stats["diggCount"]),
+                    int(stats["shareCount"]),
+                    int(stats["commentCount"]),
+                    int(stats["repostCount"]),
+                    thumbnail_s3_key,
+                    top_comments,
+                )
+                if upload:
+                    pending.append({"row": row, "upload": upload})
+                else:
+                    await queue.put(row)
+                videos_processed += 1
                 
+                # Resolve queued thumbnails before deciding the tag is done,
+                # so videos whose thumbnail fails don't count toward the limit
+                if pending and (len(pending) >= BATCH_SIZE or videos_processed >= VIDEOS_PER_TAG):
+                    resolved = await resolve_pending_thumbnails(pending)
+                    videos_processed -= len(pending) - len(resolved)
+                    for resolved_row in resolved:
+                        await queue.put(resolved_row)
+                    pending = []
+                
+                if videos_processed >= VIDEOS_PER_TAG:
+                    break
+                    
+                # Rate limiting (reduced for Lambda)
+                await asyncio.sleep(random.uniform(0.5, 1.5))
+                
+        except Exception as e:
+            logger.error("Error processing search term %s: %s", search_term, e)
+        
+        # Don't drop this tag's queued thumbnails, even if the tag failed part-way
+        if pending:
+            for resolved_row in await resolve_pending_thumbnails(pending):
+                await queue.put(resolved_row)
+
+async def save_rows_from_queue(queue: asyncio.Queue, state: Dict) -> None:
+    """Consume rows from all tags, writing every BATCH_SIZE rows, then upload the part once a None arrives."""
+    loop = asyncio.get_running_loop()
+    rows: List[TikTokRow] = []
+    while True:
+        row = await queue.get()
+        if row is None:
+            break
+        rows.append(row)
+        state['total_processed'] += 1
+        
+        # Write batch if needed
+        if len(rows) >= BATCH_SIZE:
+            state['batch_count'] += 1
+            logger.info("Writing batch #%d with %d rows", state['batch_count'], len(rows))
+            await loop.run_in_executor(None, write_batch_to_part, rows, state['batch_count'])
+            rows = []
+    
+    # Write any remaining rows
+    if rows:
+        state['batch_count'] += 1
+        logger.info("Writing final batch #%d with %d remaining rows", state['batch_count'], len(rows))
+        await loop.run_in_executor(None, write_batch_to_part, rows, state['batch_count'])
+    
+    if not await loop.run_in_executor(None, upload_part_to_s3):
+        logger.error("Failed to save collected batches to S3")
+
+async def get_tiktok_api(ms_tokens: List[str], num_sessions: int) -> TikTokApi:
+    """Return this container's TikTokApi, starting its browser sessions on first use."""
+    global _API, _API_LOCK
+    if _API_LOCK is None:
+        _API_LOCK = asyncio.Lock()
+    async with _API_LOCK:
+        if _API is None:
+            api = await TikTokApi().__aenter__()
+            try:
+                await api.create_sessions(ms_tokens=ms_tokens, headless=True, num_sessions=num_sessions)
+            except Exception:
+                await api.__aexit__(None, None, None)
+                raise
+            _API = api
+            install_shutdown_hooks()
+        return _API
+
+async def close_tiktok_api() -> None:
+    """Shut down the cached TikTokApi so the next invocation starts fresh."""
+    global _API
+    if _API is None:
+        return
+    api, _API = _API, None
+    try:
+        await api.__aexit__(None, None, None)
     except Exception as e:
-        print(f"Error saving batch to S3: {e}")
-        traceback.print_exc()
-        return 0
+        logger.warning("Error closing TikTok sessions: %s", e)
+
+def shutdown_tiktok_api() -> None:
+    """Close the cached browser before the container goes away."""
+    if _API is not None and _LOOP is not None and not _LOOP.is_closed() and not _LOOP.is_running():
+        _LOOP.run_until_complete(close_tiktok_api())
+
+def handle_sigterm(signum, frame) -> None:
+    """Lambda sends SIGTERM before freezing a container for good."""
+    if _LOOP is not None and _LOOP.is_running():
+        # The signal interrupted an invocation, so the loop can't be re-entered;
+        # close the browser on it instead and exit once that finishes
+        def close_then_exit():
+            _LOOP.create_task(close_tiktok_api()).add_done_callback(lambda task: sys.exit(0))
+        _LOOP.call_soon_threadsafe(close_then_exit)
+        return
+    shutdown_tiktok_api()
+    sys.exit(0)
+
+def install_shutdown_hooks() -> None:
+    """Register browser cleanup once there is a browser, rather than on import."""
+    global _SHUTDOWN_HOOKS_INSTALLED
+    if _SHUTDOWN_HOOKS_INSTALLED:
+        return
+    atexit.register(shutdown_tiktok_api)
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    _SHUTDOWN_HOOKS_INSTALLED = True
 
 async def collect_tiktok_data(start_time: float) -> Dict:
     """Main data collection function with time tracking for Lambda."""
@@ -266,130 +699,42 @@ async def collect_tiktok_data(start_time: float) -> Dict:
             'body': json.dumps({'error': 'No MS tokens found in environment variables'})
         }
 
-    rows: List[Dict] = []
-    attempts = 0
-    total_processed = 0
-    batch_count = 0
+    logger.info("Found %d existing thumbnails in S3", load_existing_thumbnail_keys())
+    logger.info("Found %d existing videos in S3 dataset", load_seen_video_ids())
+    migrated = migrate_legacy_parquet()
+    if migrated:
+        logger.info("Migrated %d legacy rows to %s", migrated, S3_LEGACY_PART_KEY)
+
+    state = {'start_time': start_time, 'attempts': 0, 'total_processed': 0, 'batch_count': 0}
     
     try:
-        # Use minimal sessions for Lambda
-        async with TikTokApi() as api:
-            await api.create_sessions(ms_tokens=ms_tokens, headless=True, num_sessions=1)
+        # One lightweight session per MS token (capped) so tags can run side by side
+        num_sessions = min(len(ms_tokens), NUM_SESSIONS)
+        api = await get_tiktok_api(ms_tokens, num_sessions)
+        # HTTP/2 lets concurrent cover fetches to the same CDN host share one TLS connection
+        async with httpx.AsyncClient(
+            http2=True, limits=httpx.Limits(max_connections=50, max_keepalive_connections=20)
+        ) as http_client:
+            thumbnail_semaphore = asyncio.Semaphore(THUMBNAIL_CONCURRENCY)
+            # One tag per TikTok session at a time; a tag checks a free session out and returns it when done
+            free_sessions: asyncio.Queue = asyncio.Queue()
+            for session_index in range(num_sessions):
+                free_sessions.put_nowait(session_index)
+            queue: asyncio.Queue = asyncio.Queue()
             
-            for i, search_term in enumerate(SEARCH_TERMS):
-                # Check remaining time
-                elapsed_time = time.time() - start_time
-                if elapsed_time > MAX_EXECUTION_TIME:
-                    print(f"Approaching Lambda timeout, stopping early. Processed {total_processed} videos.")
-                    break
-                
-                try:
-                    print_progress(f"Starting search for {search_term}", i+1, len(SEARCH_TERMS))
-                    tag = api.hashtag(name=search_term)
-                    
-                    videos_processed = 0
-                    async for video in tag.videos(count=VIDEOS_PER_TAG * 2):
-                        # Time check
-                        elapsed_time = time.time() - start_time
-                        if elapsed_time > MAX_EXECUTION_TIME:
-                            print("Time limit reached, stopping collection")
-                            break
-                            
-                        if attempts >= REQUEST_CAP:
-                            print("Reached request cap")
-                            break
-                        
-                        attempts += 1
-                        
-                        # Basic metadata
-                        videoDict = video.as_dict
-                        print(f"Processing video {video.id} posted at {video.create_time}")
-
-                        stats = video.stats
-                        author = video.author
-                        authorStats = videoDict["authorStats"]
-                        
-                        # Thumbnail S3 key
-                        thumbnail_s3_key = f"{S3_THUMBNAILS_PREFIX}{video.id}.jpg"
-                        
-                        row = {
-                            "video_id": video.id,
-                            "posted_ts": video.create_time.timestamp(),
-                            "description": videoDict["desc"],
-                            "author_id": author.user_id,
-                            "author_name": author.username,
-                            "follower_count": authorStats["followerCount"],
-                            "view_count": stats["playCount"],
-                            "like_count": stats["diggCount"],
-                            "share_count": stats["shareCount"],
-                            "comment_count": stats["commentCount"],
-                            "repost_count": stats["repostCount"],
-                            "thumbnail_s3_key": thumbnail_s3_key
-                        }
-                        
-                        # Handle thumbnail (skip if exists to save time)
-                        if not check_s3_object_exists(thumbnail_s3_key):
-                            try:
-                                cover_url = videoDict["video"]["cover"]
-                                if not cover_url:
-                                    print(f"No cover URL found for video {video.id}")
-                                    continue
-                                    
-                                response = requests.get(cover_url, timeout=5)  # Reduced timeout
-                                if response.status_code == 200:
-                                    if not resize_and_save_to_s3(response.content, thumbnail_s3_key):
-                                        print(f"Failed to upload thumbnail for video {video.id}")
-                                        continue
-                                else:
-                                    print(f"Failed to download thumbnail: HTTP {response.status_code}")
-                                    continue
-                            except Exception as e:
-                                print(f"Thumbnail processing failed: {e}")
-                                continue
-                        else:
-                            print(f"Thumbnail already exists in S3 for video {video.id}")
-                        
-                        # Top comments (reduced to 3 and skip if no comments)
-                        comment_count = int(stats.get('commentCount', 0))
-                        if comment_count > 0:
-                            try:
-                                row["top_comments"] = await fetch_top_comments(video, n=3)
-                            except Exception as e:
-                                print(f"Error fetching top comments for video {video.id}: {e}")
-                                row["top_comments"] = []
-                        else:
-                            row["top_comments"] = []
-                            
-                        rows.append(row)
-                        videos_processed += 1
-                        total_processed += 1
-                        
-                        # Save batch if needed
-                        if len(rows) >= BATCH_SIZE:
-                            batch_count += 1
-                            print(f"\n💾 Saving batch #{batch_count} with {len(rows)} rows to S3...")
-                            save_batch_to_s3(rows, batch_count)
-                            rows = []
-                        
-                        if videos_processed >= VIDEOS_PER_TAG:
-                            break
-                            
-                        # Rate limiting (reduced for Lambda)
-                        await asyncio.sleep(random.uniform(0.5, 1.5))
-                        
-                    if attempts >= REQUEST_CAP or elapsed_time > MAX_EXECUTION_TIME:
-                        break
-                        
-                except Exception as e:
-                    print(f"Error processing search term {search_term}: {e}")
-                    continue
-        
-        # Save any remaining rows
-        if rows:
-            batch_count += 1
-            print(f"\n💾 Saving final batch #{batch_count} with {len(rows)} remaining rows to S3...")
-            save_batch_to_s3(rows, batch_count)
+            saver = asyncio.create_task(save_rows_from_queue(queue, state))
+            try:
+                await asyncio.gather(*[
+                    process_tag(api, search_term, free_sessions,
+                                http_client, thumbnail_semaphore, state, queue)
+                    for search_term in SEARCH_TERMS
+                ])
+            finally:
+                await queue.put(None)
+                await saver
         
+        total_processed = state['total_processed']
+        batch_count = state['batch_count']
         return {
             'statusCode': 200,
             'body': json.dumps({
@@ -400,8 +745,9 @@ async def collect_tiktok_data(start_time: float) -> Dict:
         }
         
     except Exception as e:
-        print(f"Error in main collection: {e}")
-        traceback.print_exc()
+        logger.exception("Error in main collection: %s", e)
+        # Don't hand a possibly broken browser to the next warm invocation
+        await close_tiktok_api()
         return {
             'statusCode': 500,
             'body': json.dumps({'error': str(e)})
@@ -411,26 +757,22 @@ def lambda_handler(event, context):
     """AWS Lambda entry point."""
     start_time = time.time()
     
-    print("Starting TikTok data collection...")
-    print(f"S3 Bucket: {S3_BUCKET}")
-    print(f"Videos per tag: {VIDEOS_PER_TAG}")
-    print(f"Request cap: {REQUEST_CAP}")
-    print(f"Max execution time: {MAX_EXECUTION_TIME} seconds")
+    logger.info("Starting TikTok data collection...")
+    logger.info("S3 Bucket: %s", S3_BUCKET)
+    logger.info("Videos per tag: %d", VIDEOS_PER_TAG)
+    logger.info("Request cap: %d", REQUEST_CAP)
+    logger.info("Max execution time: %d seconds", MAX_EXECUTION_TIME)
     
-    # Run the async function
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+    # Run the async function on the container's long-lived loop
+    global _LOOP
+    if _LOOP is None or _LOOP.is_closed():
+        _LOOP = asyncio.new_event_loop()
+        asyncio.set_event_loop(_LOOP)
     
-    try:
-        result = loop.run_until_complete(collect_tiktok_data(start_time))
-        return result
-    finally:
-        loop.close()
+    return _LOOP.run_until_complete(collect_tiktok_data(start_time))
 
 # For local testing
 if __name__ == "__main__":
-    import sys
-    
     # Mock Lambda event and context for local testing
     class MockContext:
         def __init__(self):
@@ -0,0 +1,87 @@
+"""Tests for the shrink-on-load thumbnail resize."""
+
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+
+def make_jpeg(size=(720, 1280)) -> bytes:
+    buffer = BytesIO()
+    Image.new("RGB", size, (200, 120, 80)).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+class StubTransfer:
+    """Records uploads made through the S3 transfer manager."""
+
+    def __init__(self):
+        self.uploads = {}
+
+    def upload(self, fileobj, bucket, key, extra_args=None):
+        self.uploads[key] = fileobj.read()
+        return self
+
+    def result(self):
+        return None
+
+
+def test_draft_decodes_typical_cover_at_half_scale():
+    im = Image.open(BytesIO(make_jpeg((720, 1280))))
+    im.draft("RGB", (256, 256))
+
+    assert im.size == (360, 640)
+
+
+def test_resize_and_save_writes_256_square(tmp_path):
+    tdc = pytest.importorskip("tiktok_data_collect")
+    out_path = tmp_path / "thumb.jpg"
+
+    tdc.resize_and_save(make_jpeg(), out_path)
+
+    with Image.open(out_path) as im:
+        assert im.size == (256, 256)
+        assert im.format == "JPEG"
+
+
+def test_resize_and_save_to_s3_uploads_256_square(monkeypatch):
+    tdc = pytest.importorskip("tiktok_data_collect_s3")
+    transfer = StubTransfer()
+    monkeypatch.setattr(tdc, "s3_transfer", transfer)
+
+    assert tdc.resize_and_save_to_s3(make_jpeg(), "thumbs/1.jpg") is True
+    with Image.open(BytesIO(transfer.uploads["thumbs/1.jpg"])) as im:
+        assert im.size == (256, 256)
+
+
+def test_resize_and_save_to_s3_uploads_256_jpeg_unchanged(monkeypatch):
+    tdc = pytest.importorskip("tiktok_data_collect_s3")
+    transfer = StubTransfer()
+    monkeypatch.setattr(tdc, "s3_transfer", transfer)
+    monkeypatch.setattr(tdc.Image.Image, "resize", lambda *a, **k: pytest.fail("should not resize"))
+    original = make_jpeg((256, 256))
+
+    assert tdc.resize_and_save_to_s3(original, "thumbs/1.jpg") is True
+    assert transfer.uploads["thumbs/1.jpg"] == original
+
+
+def test_resize_and_save_to_s3_rejects_oversized_cover(monkeypatch):
+    tdc = pytest.importorskip("tiktok_data_collect_s3")
+    monkeypatch.setattr(tdc, "s3_transfer", None)  # any upload attempt would raise
+    monkeypatch.setattr(tdc, "MAX_COVER_PIXELS", 720 * 1280 - 1)
+
+    assert tdc.resize_and_save_to_s3(make_jpeg((720, 1280)), "thumbs/1.jpg") is False
+
+
+def test_resize_and_save_to_s3_handles_large_png(monkeypatch):
+    tdc = pytest.importorskip("tiktok_data_collect_s3")
+    transfer = StubTransfer()
+    monkeypatch.setattr(tdc, "s3_transfer", transfer)
+    buffer = BytesIO()
+    Image.new("RGB", (1080, 1920), (10, 200, 30)).save(buffer, format="PNG")
+
+    assert tdc.resize_and_save_to_s3(buffer.getvalue(), "thumbs/1.jpg") is True
+    with Image.open(BytesIO(transfer.uploads["thumbs/1.jpg"])) as im:
+        assert im.size == (256, 256)
+        r, g, b = im.getpixel((128, 128))
+        assert g > 150 and r < 60 and b < 80
@@ -0,0 +1,602 @@
+"""Tests for the local collection script's per-video pipeline."""
+
+import asyncio
+import contextlib
+import datetime as dt
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+tdc = pytest.importorskip("tiktok_data_collect")
+
+
+class FakeAuthor:
+    user_id = "42"
+    username = "creator"
+
+
+class FakeVideo:
+    def __init__(self, video_id, comment_count=0):
+        self.id = video_id
+        self.create_time = dt.datetime(2024, 1, 1, tzinfo=dt.timezone.utc)
+        self.author = FakeAuthor()
+        self.stats = {
+            "playCount": 10,
+            "diggCount": 5,
+            "shareCount": 1,
+            "commentCount": comment_count,
+            "repostCount": 0,
+        }
+        self.as_dict = {
+            "desc": "#kbeauty routine",
+            "authorStats": {"followerCount": 100},
+            "video": {"cover": f"https://example.com/{video_id}.jpg"},
+        }
+
+
+class FakeBar:
+    def __init__(self):
+        self.n = 0
+
+    def update(self, n):
+        self.n += n
+
+
+@pytest.fixture
+def thumbs_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(tdc, "THUMBS_DIR", tmp_path)
+    return tmp_path
+
+
+def touch_thumbnail(client, url, path):
+    async def download():
+        path.write_bytes(b"jpeg")
+        return True
+
+    return download()
+
+
+def skip_download(client, url, path):
+    return asyncio.sleep(0, True)
+
+
+def run_videos(videos, concurrency=2, http_client=None):
+    async def run():
+        limiter = tdc.AdaptiveLimiter(concurrency, 1, concurrency)
+        pbar = FakeBar()
+        results = await asyncio.gather(
+            *[tdc.process_video(v, limiter, pbar, http_client) for v in videos],
+            return_exceptions=True,
+        )
+        return results, pbar
+
+    return asyncio.run(run())
+
+
+def test_process_video_builds_row(thumbs_dir, monkeypatch):
+    monkeypatch.setattr(tdc, "download_thumbnail", touch_thumbnail)
+
+    (row,), pbar = run_videos([FakeVideo("1")])
+
+    assert row["video_id"] == "1"
+    assert row["thumbnail_path"] == str(thumbs_dir / "1.jpg")
+    assert row["top_comments"] == []
+    assert pbar.n == 1
+
+
+def test_process_video_skips_existing_thumbnail(thumbs_dir, monkeypatch):
+    (thumbs_dir / "1.jpg").write_bytes(b"jpeg")
+    monkeypatch.setattr(tdc, "download_thumbnail", lambda client, url, path: pytest.fail("re-downloaded"))
+
+    (row,), pbar = run_videos([FakeVideo("1")])
+
+    assert row is None
+    assert pbar.n == 1
+
+
+def test_process_video_claims_thumbnail_once(thumbs_dir, monkeypatch):
+    downloads = []
+
+    async def slow_download(client, url, path):
+        downloads.append(url)
+        await asyncio.sleep(0.01)
+        path.write_bytes(b"jpeg")
+        return True
+
+    monkeypatch.setattr(tdc, "download_thumbnail", slow_download)
+
+    results, _ = run_videos([FakeVideo("1"), FakeVideo("1")])
+
+    assert len(downloads) == 1
+    assert sum(r is not None for r in results) == 1
+
+
+def test_process_video_releases_claim_when_download_fails(thumbs_dir, monkeypatch):
+    monkeypatch.setattr(tdc, "download_thumbnail", lambda client, url, path: asyncio.sleep(0, False))
+
+    (row,), _ = run_videos([FakeVideo("1")])
+
+    assert row is None
+    assert list(thumbs_dir.iterdir()) == []
+
+
+def test_thumbnail_appears_only_when_complete(thumbs_dir, monkeypatch):
+    seen = []
+
+    async def download(client, url, path):
+        seen.append((path.name, (thumbs_dir / "1.jpg").exists()))
+        path.write_bytes(b"jpeg")
+        return True
+
+    monkeypatch.setattr(tdc, "download_thumbnail", download)
+
+    (row,), _ = run_videos([FakeVideo("1")])
+
+    assert seen == [("1.jpg.part", False)]
+    assert row["thumbnail_path"] == str(thumbs_dir / "1.jpg")
+    assert [p.name for p in thumbs_dir.iterdir()] == ["1.jpg"]
+
+
+def test_stale_claims_are_cleared_at_startup(thumbs_dir):
+    (thumbs_dir / "1.jpg.part").touch()  # crashed mid-download
+    (thumbs_dir / "2.jpg").touch()  # 0-byte claim from the old scheme
+    (thumbs_dir / "3.jpg").write_bytes(b"jpeg")
+
+    assert tdc.clear_stale_claims() == 2
+    assert [p.name for p in thumbs_dir.iterdir()] == ["3.jpg"]
+
+
+def test_process_video_respects_concurrency_limit(thumbs_dir, monkeypatch):
+    active = 0
+    peak = 0
+
+    async def slow_comments(video, n=5):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+        return ["nice"]
+
+    monkeypatch.setattr(tdc, "download_thumbnail", skip_download)
+    monkeypatch.setattr(tdc, "fetch_top_comments", slow_comments)
+
+    results, _ = run_videos([FakeVideo(str(i), comment_count=3) for i in range(6)], concurrency=2)
+
+    assert [r["top_comments"] for r in results] == [["nice"]] * 6
+    assert peak == 2
+
+
+def test_process_video_retries_after_rate_limit(thumbs_dir, monkeypatch):
+    calls = 0
+
+    async def flaky_comments(video, n=5):
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            raise tdc.CaptchaException(None, "captcha")
+        return ["ok"]
+
+    monkeypatch.setattr(tdc, "download_thumbnail", touch_thumbnail)
+    monkeypatch.setattr(tdc, "fetch_top_comments", flaky_comments)
+
+    (row,), _ = run_videos([FakeVideo("1", comment_count=3)])
+
+    assert row["top_comments"] == ["ok"]
+    assert calls == 2
+
+
+def test_adaptive_limiter_grows_on_success_and_halves_on_overload():
+    async def run():
+        limiter = tdc.AdaptiveLimiter(4, 1, 5)
+        for _ in range(4):
+            async with limiter:
+                pass
+        grown = limiter.limit
+        with pytest.raises(tdc.EmptyResponseException):
+            async with limiter:
+                raise tdc.EmptyResponseException(None, "blank")
+        return grown, limiter.limit
+
+    assert asyncio.run(run()) == (5, 2)
+
+
+def test_token_bucket_spaces_requests_after_burst():
+    async def run():
+        limiter = tdc.TokenBucket(50.0, capacity=1)
+        start = time.monotonic()
+        for _ in range(3):
+            await limiter.acquire()
+        return time.monotonic() - start
+
+    assert asyncio.run(run()) >= 0.035
+
+
+def test_every_tiktok_request_takes_a_token():
+    class CountingBucket:
+        acquired = 0
+
+        async def acquire(self):
+            self.acquired += 1
+
+    class Api:
+        async def make_request(self, url, **kwargs):
+            return url
+
+    api, rate = Api(), CountingBucket()
+    tdc.pace_requests(api, rate)
+
+    async def pages():  # one feed page, then two comment pages
+        return [await api.make_request(url=url) for url in ("challenge/item_list", "comment/list", "comment/list")]
+
+    assert asyncio.run(pages()) == ["challenge/item_list", "comment/list", "comment/list"]
+    assert rate.acquired == 3
+
+
+def test_write_rows_appends_zstd_row_groups_to_one_part(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    part_path = tmp_path / "part.parquet"
+
+    writer = tdc.write_rows(None, part_path, [{"video_id": "1"}, {"video_id": "2"}])
+    assert tdc.write_rows(writer, part_path, [{"video_id": "3"}]) is writer
+    writer.close()
+
+    metadata = pq.ParquetFile(part_path).metadata
+    assert metadata.num_rows == 3
+    assert metadata.num_row_groups == 2
+    assert metadata.row_group(0).column(0).compression == "ZSTD"
+
+
+class StubResponse:
+    """Streams content in fixed-size chunks, like httpx's aiter_raw()."""
+
+    def __init__(self, status_code, content=b"", headers=None, chunk_size=7):
+        self.status_code = status_code
+        self.content = content
+        self.headers = {"Content-Length": str(len(content))} if headers is None else headers
+        self.chunk_size = chunk_size
+
+    async def aiter_raw(self):
+        for i in range(0, len(self.content), self.chunk_size):
+            yield self.content[i:i + self.chunk_size]
+
+    async def aread(self):
+        return self.content
+
+
+class StubClient:
+    def __init__(self, response):
+        self.response = response
+        self.urls = []
+
+    @contextlib.asynccontextmanager
+    async def stream(self, method, url, timeout=None):
+        self.urls.append(url)
+        yield self.response
+
+
+@pytest.fixture
+def inline_pool(monkeypatch):
+    """Run resizes on a thread pool so monkeypatched functions are visible to the workers."""
+    pool = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(tdc, "get_thumb_pool", lambda: pool)
+    yield pool
+    pool.shutdown()
+
+
+def test_download_thumbnail_resizes_through_shared_client(tmp_path):
+    buffer = BytesIO()
+    Image.new("RGB", (720, 1280), (200, 120, 80)).save(buffer, format="JPEG")
+    client = StubClient(StubResponse(200, buffer.getvalue()))
+    thumb_path = tmp_path / "1.jpg"
+
+    asyncio.run(tdc.download_thumbnail(client, "https://example.com/1.jpg", thumb_path))
+
+    assert client.urls == ["https://example.com/1.jpg"]
+    with Image.open(thumb_path) as im:
+        assert im.size == (256, 256)
+
+
+def test_download_thumbnail_skips_failed_response(tmp_path):
+    thumb_path = tmp_path / "1.jpg"
+
+    ok = asyncio.run(tdc.download_thumbnail(StubClient(StubResponse(404)), "https://example.com/1.jpg", thumb_path))
+
+    assert ok is False
+    assert not thumb_path.exists()
+
+
+def test_download_thumbnail_resizes_in_thumb_pool(tmp_path, monkeypatch, inline_pool):
+    calls = []
+    monkeypatch.setattr(tdc, "resize_and_save", lambda data, path: calls.append((bytes(data), path)))
+    thumb_path = tmp_path / "1.jpg"
+
+    asyncio.run(tdc.download_thumbnail(StubClient(StubResponse(200, b"jpeg")), "https://example.com/1.jpg", thumb_path))
+
+    assert calls == [(b"jpeg", thumb_path)]
+
+
+def test_extract_hashtags():
+    assert tdc.extract_hashtags("love this #kbeauty #skin_care routine #") == ["kbeauty", "skin_care"]
+
+
+class FakeComment:
+    def __init__(self, likes, text):
+        self.as_dict = {"digg_count": likes}
+        self.text = text
+
+
+class CommentedVideo:
+    def __init__(self, comments):
+        self._comments = comments
+
+    async def comments(self, count):
+        for comment in self._comments:
+            yield comment
+
+
+def test_fetch_top_comments_keeps_most_liked_in_order():
+    likes = [3, None, 50, 7, 12, 1, 40, 9]
+    video = CommentedVideo([FakeComment(n, f"c{i}") for i, n in enumerate(likes)])
+
+    top = asyncio.run(tdc.fetch_top_comments(video, n=3))
+
+    assert top == ["c2", "c6", "c4"]
+
+
+def test_write_rows_uses_explicit_schema(tmp_path, thumbs_dir, monkeypatch):
+    pq = pytest.importorskip("pyarrow.parquet")
+    monkeypatch.setattr(tdc, "download_thumbnail", touch_thumbnail)
+    (row,), _ = run_videos([FakeVideo("1")])
+    part_path = tmp_path / "part.parquet"
+
+    tdc.write_rows(None, part_path, [row]).close()
+
+    table = pq.read_table(part_path)
+    assert table.schema.names == tdc.SCHEMA.names
+    assert table.schema.field("posted_ts").type.tz == "UTC"  # Parquet stores [s] as [ms]
+    assert table.schema.field("view_count").type == tdc.SCHEMA.field("view_count").type
+    assert table["posted_ts"][0].as_py() == dt.datetime(2024, 1, 1, tzinfo=dt.timezone.utc)
+    assert table["top_comments"].to_pylist() == [[]]
+    assert table["hashtags"].to_pylist() == [["kbeauty"]]
+
+
+class FakeTag:
+    def __init__(self, name, videos, calls, live_sessions=None):
+        self.name = name
+        self._videos = videos
+        self._calls = calls
+        self._live = live_sessions if live_sessions is not None else set()
+
+    async def videos(self, count, session_index=None):
+        self._calls.append((self.name, session_index))
+        assert session_index not in self._live, f"session {session_index} already in use"
+        self._live.add(session_index)
+        try:
+            for video in self._videos:
+                yield video
+                await asyncio.sleep(0)
+        finally:
+            self._live.discard(session_index)
+
+
+class FakeTikTokApi:
+    tags = {}
+    calls = []
+    live_sessions = set()
+    num_sessions = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def create_sessions(self, num_sessions, **kwargs):
+        FakeTikTokApi.num_sessions = num_sessions
+
+    async def make_request(self, **kwargs):
+        return None
+
+    def hashtag(self, name):
+        return FakeTag(name, self.tags.get(name, []), self.calls, self.live_sessions)
+
+
+@pytest.fixture
+def collector(tmp_path, monkeypatch):
+    """Run main() against fake tags, recording which videos get processed and saved."""
+    processed = []
+    saved = []
+
+    async def fake_process_video(video, limiter, pbar, http_client):
+        processed.append(video.id)
+        return {"video_id": video.id}
+
+    monkeypatch.setattr(tdc, "TikTokApi", FakeTikTokApi)
+    monkeypatch.setattr(tdc.glob, "glob", lambda pattern: ["cookies/a.txt"])
+    monkeypatch.setattr(tdc, "load_cookies_txt", lambda path: {"msToken": "token"})
+    monkeypatch.setattr(tdc, "process_video", fake_process_video)
+    monkeypatch.setattr(tdc, "PARTS_DIR", tmp_path / "parts")
+    monkeypatch.setattr(tdc, "THUMBS_DIR", tmp_path / "thumbnails")
+    monkeypatch.setattr(tdc, "LEGACY_DATASET", tmp_path / "tiktok_beauty_dataset.parquet")
+
+    real_write_rows = tdc.write_rows
+
+    def recording_write_rows(writer, part_path, rows):
+        saved.extend(r["video_id"] for r in rows)
+        return real_write_rows(writer, part_path, rows)
+
+    monkeypatch.setattr(tdc, "write_rows", recording_write_rows)
+
+    def run(tags):
+        monkeypatch.setattr(FakeTikTokApi, "tags", tags)
+        monkeypatch.setattr(FakeTikTokApi, "calls", [])
+        monkeypatch.setattr(FakeTikTokApi, "live_sessions", set())
+        monkeypatch.setattr(tdc, "SEARCH_TERMS", list(tags))
+        asyncio.run(tdc.main())
+        return processed, saved
+
+    return run
+
+
+def test_old_videos_are_dropped_before_processing(collector, monkeypatch):
+    monkeypatch.setattr(tdc, "SKIP_OLD_VIDEOS", True)
+    old, new = FakeVideo("old"), FakeVideo("new")
+    new.create_time = dt.datetime.now(dt.timezone.utc)
+
+    processed, saved = collector({"kbeauty": [old, new]})
+
+    assert processed == ["new"]
+    assert saved == ["new"]
+
+
+@pytest.mark.parametrize("headers", [None, {}, {"Content-Length": "4", "Content-Encoding": "gzip"}])
+def test_read_body_assembles_streamed_chunks(headers):
+    response = StubResponse(200, bytes(range(30)), headers=headers)
+
+    assert asyncio.run(tdc.read_body(response)) == bytes(range(30))
+
+
+@pytest.mark.parametrize("length", ["29", "31"])
+def test_read_body_rejects_length_mismatch(length):
+    response = StubResponse(200, bytes(range(30)), headers={"Content-Length": length})
+
+    with pytest.raises(ValueError):
+        asyncio.run(tdc.read_body(response))
+
+
+def test_main_streams_each_round_into_one_part(collector, monkeypatch):
+    pq = pytest.importorskip("pyarrow.parquet")
+    monkeypatch.setattr(tdc, "BATCH_SIZE", 2)
+
+    _, saved = collector({"kbeauty": [FakeVideo(str(i)) for i in range(5)]})
+
+    (part,) = (tdc.PARTS_DIR).glob("*.parquet")
+    assert saved == ["0", "1", "2", "3", "4"]
+    assert pq.read_table(part)["video_id"].to_pylist() == saved
+    assert pq.ParquetFile(part).metadata.num_row_groups == 3
+
+
+def test_legacy_dataset_migrates_into_parts_once(tmp_path, monkeypatch):
+    pd = pytest.importorskip("pandas")
+    pq = pytest.importorskip("pyarrow.parquet")
+    monkeypatch.setattr(tdc, "OUT_DIR", tmp_path)
+    monkeypatch.setattr(tdc, "PARTS_DIR", tmp_path / "parts")
+    monkeypatch.setattr(tdc, "LEGACY_DATASET", tmp_path / "tiktok_beauty_dataset.parquet")
+    tdc.PARTS_DIR.mkdir()
+    pd.DataFrame({  # the old collector's shape: float posted_ts and no hashtags column
+        "video_id": ["a"], "posted_ts": [1704067200.5], "description": ["glow #kbeauty"],
+        "author_id": ["1"], "author_name": ["n"], "follower_count": [10], "view_count": [100],
+        "like_count": [1], "share_count": [0], "comment_count": [2], "repost_count": [0],
+        "top_comments": [["nice"]], "thumbnail_path": ["tiktok_data/thumbnails/a.jpg"],
+    }).to_parquet(tdc.LEGACY_DATASET, index=False)
+
+    assert tdc.migrate_legacy_dataset() == 1
+    assert tdc.migrate_legacy_dataset() == 0
+
+    table = pq.read_table(tdc.PARTS_DIR)
+    assert table.schema.names == tdc.SCHEMA.names
+    assert table["posted_ts"][0].as_py() == dt.datetime(2024, 1, 1, tzinfo=dt.timezone.utc)
+    assert table["hashtags"].to_pylist() == [["kbeauty"]]
+    assert (tmp_path / "legacy" / "tiktok_beauty_dataset.parquet").exists()
+
+
+def test_per_video_messages_are_debug_only(thumbs_dir, monkeypatch, caplog):
+    monkeypatch.setattr(tdc, "download_thumbnail", touch_thumbnail)
+    caplog.set_level("INFO", logger=tdc.logger.name)
+
+    (row,), _ = run_videos([FakeVideo("1")])
+
+    assert row is not None
+    assert caplog.records == []
+
+
+def test_load_cookies_txt_prefers_latest_expiry_and_http_only(tmp_path):
+    cookie_file = tmp_path / "cookies.txt"
+    cookie_file.write_text(
+        "# Netscape HTTP Cookie File\n"
+        "www.tiktok.com\tFALSE\t/\tFALSE\t1755688090\tmsToken\tnewer\n"
+        ".tiktok.com\tTRUE\t/\tTRUE\t1748776091\tmsToken\tolder\n"
+        "#HttpOnly_.tiktok.com\tTRUE\t/\tTRUE\t1755688090\tsessionid\tabc\n"
+    )
+
+    assert tdc.load_cookies_txt(str(cookie_file)) == {"msToken": "newer", "sessionid": "abc"}
+
+
+def test_load_cookies_txt_skips_file_without_header(tmp_path):
+    cookie_file = tmp_path / "cookies.txt"
+    cookie_file.write_text(".tiktok.com\tTRUE\t/\tTRUE\t1748776091\tmsToken\tvalue\n")
+
+    assert tdc.load_cookies_txt(str(cookie_file)) == {}
+
+
+def test_target_window_is_one_utc_day_in_int_seconds():
+    assert isinstance(tdc.TARGET_START, int) and isinstance(tdc.TARGET_END, int)
+    assert tdc.TARGET_END - tdc.TARGET_START == 86399
+    assert dt.datetime.fromtimestamp(tdc.TARGET_START, dt.timezone.utc).date() == tdc.TARGET_DATE
+
+
+def test_process_video_reads_string_stats_as_ints(thumbs_dir, monkeypatch):
+    monkeypatch.setattr(tdc, "download_thumbnail", touch_thumbnail)
+    video = FakeVideo("1")
+    video.stats = {key: str(value) for key, value in video.stats.items()}  # statsV2 shape
+    video.stats["collectCount"] = "3"
+
+    (row,), _ = run_videos([video])
+
+    assert (row["view_count"], row["like_count"], row["comment_count"]) == (10, 5, 0)
+
+
+def test_hashtags_column_matches_extract_hashtags():
+    pa = pytest.importorskip("pyarrow")
+    descriptions = [
+        "love this #kbeauty #skin_care routine #",
+        "abc#tag#two\nnext #x",
+        "韓国メイク #メイク #ok_1 ＃full",
+        "##a",
+        "",
+        "no tags here",
+    ]
+
+    tags = tdc.hashtags_column(pa.chunked_array([descriptions + [None]]))
+
+    assert tags.to_pylist() == [tdc.extract_hashtags(d) for d in descriptions] + [None]
+
+
+def test_sessions_are_bounded_by_cookie_tokens(collector, monkeypatch):
+    monkeypatch.setattr(tdc, "NUM_SESSIONS", 2)
+    tags = {name: [FakeVideo(f"{name}-{i}") for i in range(3)] for name in ("a", "b", "c")}
+
+    processed, _ = collector(tags)
+
+    assert FakeTikTokApi.num_sessions == 1  # bounded by the single cookie token
+    assert sorted(processed) == sorted(v.id for vs in tags.values() for v in vs)
+
+
+def test_live_tags_never_share_a_session(collector, monkeypatch):
+    monkeypatch.setattr(tdc.glob, "glob", lambda pattern: ["cookies/a.txt", "cookies/b.txt"])
+    # "b" finishes first, so "c" must take its session rather than "a"'s (which is still live)
+    tags = {"a": [FakeVideo(f"a-{i}") for i in range(3)], "b": [FakeVideo("b-0")],
+            "c": [FakeVideo(f"c-{i}") for i in range(2)]}
+
+    processed, _ = collector(tags)
+
+    assert FakeTikTokApi.calls == [("a", 0), ("b", 1), ("c", 1)]
+    assert sorted(processed) == sorted(v.id for vs in tags.values() for v in vs)
+
+
+def test_tags_interleave_and_share_request_cap(collector, monkeypatch):
+    monkeypatch.setattr(tdc.glob, "glob", lambda pattern: ["cookies/a.txt", "cookies/b.txt"])
+    monkeypatch.setattr(tdc, "REQUEST_CAP", 5)
+    monkeypatch.setattr(tdc, "BATCH_SIZE", 1)
+    tags = {name: [FakeVideo(f"{name}-{i}") for i in range(4)] for name in ("a", "b")}
+
+    processed, saved = collector(tags)
+
+    assert FakeTikTokApi.calls == [("a", 0), ("b", 1)]
+    assert len(processed) == 5
+    assert {video_id[0] for video_id in processed[:2]} == {"a", "b"}
+    assert saved == processed
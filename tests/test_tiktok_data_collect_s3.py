@@ -0,0 +1,646 @@
+"""Tests for the S3 collectors' concurrent thumbnail pipeline (both Lambda handlers)."""
+
+import asyncio
+import datetime as dt
+import json
+import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+
+import pytest
+
+from test_thumbnails import StubTransfer, make_jpeg
+
+tdc = None  # the Lambda handler under test; set by the lambda_module fixture
+
+
+@pytest.fixture(autouse=True, scope="module", params=["tiktok_data_collect_s3", "tiktok_data_collect_s3_optimized"])
+def lambda_module(request):
+    """Run every test against both Lambda handlers, which are kept in step."""
+    global tdc
+    tdc = pytest.importorskip(request.param)
+    return tdc
+
+
+# ---------- stubs ----------
+class StubResponse:
+    def __init__(self, status: int, body: bytes = b""):
+        self.status_code = status
+        self.content = body
+
+
+class StubClient:
+    def __init__(self, responses):
+        self.responses = responses
+
+    async def get(self, url, timeout=None):
+        return self.responses[url]
+
+
+class FakeAuthor:
+    def __init__(self, video_id: str):
+        self.user_id = f"user-{video_id}"
+        self.username = f"name-{video_id}"
+
+
+class FakeVideo:
+    def __init__(self, video_id: str):
+        self.id = video_id
+        self.create_time = dt.datetime(2025, 1, 1)
+        self.author = FakeAuthor(video_id)
+        self.stats = {"playCount": 1, "diggCount": 2, "shareCount": 3, "commentCount": 0, "repostCount": 4}
+        self.as_dict = {
+            "desc": f"video {video_id} #tag",
+            "authorStats": {"followerCount": 10},
+            "video": {"cover": f"https://cdn.example/{video_id}.jpg"},
+        }
+
+
+class FakeTag:
+    def __init__(self, name, videos, calls, live_sessions=None):
+        self.name = name
+        self._videos = videos
+        self._calls = calls
+        self._live = live_sessions if live_sessions is not None else set()
+
+    async def videos(self, count: int, session_index=None):
+        self._calls.append((self.name, session_index))
+        assert session_index not in self._live, f"session {session_index} already in use"
+        self._live.add(session_index)
+        try:
+            for video in self._videos:
+                yield video
+                await asyncio.sleep(0)
+        finally:
+            self._live.discard(session_index)
+
+
+class FakeTikTokApi:
+    videos_by_tag = {}
+    num_sessions = None
+    calls = []
+    live_sessions = set()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def create_sessions(self, num_sessions, **kwargs):
+        FakeTikTokApi.num_sessions = num_sessions
+
+    def hashtag(self, name: str) -> FakeTag:
+        return FakeTag(name, self.videos_by_tag[name], self.calls, self.live_sessions)
+
+
+@pytest.fixture
+def collector(monkeypatch):
+    """Patch the collector so it runs against fake TikTok/S3 and records saved batches."""
+    saved = []
+    failing_ids = set()
+
+    async def fake_fetch_and_upload(client, semaphore, video_id, cover_url, s3_key):
+        return video_id not in failing_ids
+
+    monkeypatch.setenv("MS_TOKEN", "token")
+    monkeypatch.setattr(tdc, "TikTokApi", FakeTikTokApi)
+    monkeypatch.setattr(tdc, "_API", None)
+    monkeypatch.setattr(tdc, "_API_LOCK", None)
+    monkeypatch.setattr(tdc, "_SHUTDOWN_HOOKS_INSTALLED", True)  # keep pytest's own SIGTERM handling
+    monkeypatch.setattr(tdc, "fetch_and_upload", fake_fetch_and_upload)
+    monkeypatch.setattr(tdc, "load_existing_thumbnail_keys", lambda: 0)
+    monkeypatch.setattr(tdc, "load_seen_video_ids", lambda: 0)
+    monkeypatch.setattr(tdc, "migrate_legacy_parquet", lambda: 0)
+    monkeypatch.setattr(tdc, "check_s3_object_exists", lambda key: False)
+    monkeypatch.setattr(tdc, "write_batch_to_part", lambda rows, n: saved.append([r.video_id for r in rows]))
+    monkeypatch.setattr(tdc, "upload_part_to_s3", lambda: True)
+    monkeypatch.setattr(tdc.random, "uniform", lambda a, b: 0)
+    monkeypatch.setattr(tdc, "REQUEST_CAP", 1000)
+
+    def run(videos_by_tag, batch_size, videos_per_tag=1000, fail=()):
+        failing_ids.update(fail)
+        monkeypatch.setattr(FakeTikTokApi, "videos_by_tag", videos_by_tag)
+        monkeypatch.setattr(FakeTikTokApi, "calls", [])
+        monkeypatch.setattr(FakeTikTokApi, "live_sessions", set())
+        monkeypatch.setattr(tdc, "SEARCH_TERMS", list(videos_by_tag))
+        monkeypatch.setattr(tdc, "BATCH_SIZE", batch_size)
+        monkeypatch.setattr(tdc, "VIDEOS_PER_TAG", videos_per_tag)
+        result = asyncio.run(tdc.collect_tiktok_data(start_time=tdc.time.time()))
+        return result, saved
+
+    return run
+
+
+def videos(*ids):
+    return [FakeVideo(video_id) for video_id in ids]
+
+
+def test_string_stats_are_stored_as_ints(collector, monkeypatch):
+    rows = []
+    monkeypatch.setattr(tdc, "write_batch_to_part", lambda batch, n: rows.extend(batch))
+    video = FakeVideo("1")
+    video.stats = {key: str(value) for key, value in video.stats.items()}  # statsV2 shape
+
+    collector({"tag": [video]}, batch_size=10)
+
+    assert (rows[0].view_count, rows[0].like_count, rows[0].repost_count) == (1, 2, 4)
+
+
+# ---------- thumbnail key cache ----------
+class StubPaginator:
+    def __init__(self, pages):
+        self.pages = pages
+        self.calls = []
+
+    def paginate(self, **kwargs):
+        self.calls.append(kwargs)
+        return iter(self.pages)
+
+
+def test_load_existing_thumbnail_keys_lists_prefix_once(monkeypatch):
+    paginator = StubPaginator([
+        {"Contents": [{"Key": "raw/thumbnails/1.jpg"}, {"Key": "raw/thumbnails/2.jpg"}]},
+        {"Contents": [{"Key": "raw/thumbnails/3.jpg"}]},
+        {},
+    ])
+
+    class StubS3:
+        def get_paginator(self, name):
+            assert name == "list_objects_v2"
+            return paginator
+
+    monkeypatch.setattr(tdc, "s3_client", StubS3())
+    monkeypatch.setattr(tdc, "EXISTING_THUMBS", {"stale/key.jpg"})
+
+    assert tdc.load_existing_thumbnail_keys() == 3
+    assert paginator.calls == [{"Bucket": tdc.S3_BUCKET, "Prefix": tdc.S3_THUMBNAILS_PREFIX}]
+    assert tdc.check_s3_object_exists("raw/thumbnails/2.jpg")
+    assert not tdc.check_s3_object_exists("stale/key.jpg")
+
+
+def test_thumbnail_upload_failure_is_not_cached(monkeypatch):
+    class FailingTransfer(StubTransfer):
+        def result(self):
+            raise tdc.ClientError({"Error": {"Code": "SlowDown"}}, "PutObject")
+
+    monkeypatch.setattr(tdc, "s3_transfer", FailingTransfer())
+    monkeypatch.setattr(tdc, "EXISTING_THUMBS", set())
+
+    assert tdc.resize_and_save_to_s3(make_jpeg(), "raw/thumbnails/9.jpg") is False
+    assert not tdc.check_s3_object_exists("raw/thumbnails/9.jpg")
+
+
+def test_uploaded_thumbnail_is_added_to_cache(monkeypatch):
+    monkeypatch.setattr(tdc, "s3_transfer", StubTransfer())
+    monkeypatch.setattr(tdc, "EXISTING_THUMBS", set())
+
+    assert tdc.resize_and_save_to_s3(make_jpeg(), "raw/thumbnails/9.jpg")
+    assert tdc.check_s3_object_exists("raw/thumbnails/9.jpg")
+
+
+# ---------- parquet output ----------
+class RecordingS3:
+    """In-memory S3 stand-in for get/put/copy/delete_object."""
+
+    def __init__(self, objects=None):
+        self.objects = dict(objects or {})
+
+    def put_object(self, Bucket, Key, Body, ContentType):
+        self.objects[Key] = Body if isinstance(Body, (bytes, str)) else Body.read()
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise tdc.ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+        body = self.objects[Key]
+        return {"Body": BytesIO(body.encode() if isinstance(body, str) else body)}
+
+    def copy_object(self, Bucket, Key, CopySource):
+        self.objects[Key] = self.objects[CopySource["Key"]]
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop(Key, None)
+
+    def parts(self):
+        return {k: v for k, v in self.objects.items() if k.startswith(tdc.S3_PARTS_PREFIX)}
+
+
+def make_row(video_id, **overrides):
+    row = {
+        "video_id": video_id,
+        "posted_ts": 1700000000,
+        "description": "#kbeauty",
+        "author_id": "42",
+        "author_name": "someone",
+        "follower_count": 10,
+        "view_count": 100,
+        "like_count": 5,
+        "share_count": 1,
+        "comment_count": 2,
+        "repost_count": 0,
+        "thumbnail_s3_key": f"raw/thumbnails/{video_id}.jpg",
+        "top_comments": [],
+    }
+    row.update(overrides)
+    return tdc.TikTokRow(**row)
+
+
+@pytest.fixture
+def part_s3(monkeypatch):
+    s3 = RecordingS3()
+    monkeypatch.setattr(tdc, "s3_client", s3)
+    monkeypatch.setattr(tdc, "SEEN_VIDEO_IDS", tdc.pd.Index([], dtype=tdc.VIDEO_ID_DTYPE))
+    monkeypatch.setattr(tdc, "_PART_SINK", None)
+    monkeypatch.setattr(tdc, "_PART_WRITER", None)
+    return s3
+
+
+def test_batches_stream_into_one_zstd_part(part_s3):
+    pq = pytest.importorskip("pyarrow.parquet")
+
+    tdc.write_batch_to_part([make_row("1", top_comments=["nice"]), make_row("2")], 1)
+    tdc.write_batch_to_part([make_row("3")], 2)
+    assert part_s3.parts() == {}  # nothing is uploaded until the part is closed
+
+    assert tdc.upload_part_to_s3() is True
+    [body] = part_s3.parts().values()
+    part = pq.ParquetFile(BytesIO(body))
+    assert part.metadata.num_row_groups == 2
+    assert part.metadata.row_group(0).column(0).compression == "ZSTD"
+    table = part.read()
+    assert table.schema.equals(tdc.BATCH_SCHEMA)
+    assert table.column("video_id").to_pylist() == ["1", "2", "3"]
+    assert table.column("top_comments").to_pylist() == [["nice"], [], []]
+
+
+def test_row_fields_match_batch_schema():
+    assert list(tdc.TikTokRow._fields) == tdc.BATCH_SCHEMA.names
+
+
+def test_count_overflow_fails_the_batch(part_s3):
+    assert tdc.write_batch_to_part([make_row("1", view_count=2**32)], 1) == 0
+    assert len(tdc.SEEN_VIDEO_IDS) == 0
+    assert tdc._PART_WRITER is None
+
+
+def test_counts_are_written_as_uint32(part_s3):
+    pq = pytest.importorskip("pyarrow.parquet")
+
+    tdc.write_batch_to_part([make_row("1", view_count=3_000_000_000)], 1)
+    tdc.upload_part_to_s3()
+
+    [body] = part_s3.parts().values()
+    table = pq.read_table(BytesIO(body))
+    assert str(table.schema.field("view_count").type) == "uint32"
+    assert str(table.schema.field("posted_ts").type) == "uint32"
+    assert table.column("view_count").to_pylist() == [3_000_000_000]
+
+
+def test_write_batch_to_part_drops_duplicates_within_and_across_batches(part_s3):
+    tdc.write_batch_to_part([make_row("1"), make_row("2"), make_row("1")], 1)
+    total = tdc.write_batch_to_part([make_row("2"), make_row("3")], 2)
+    tdc.upload_part_to_s3()
+
+    assert total == 3
+    [body] = part_s3.parts().values()
+    assert tdc.pd.read_parquet(BytesIO(body))["video_id"].tolist() == ["1", "2", "3"]
+    assert sorted(json.loads(part_s3.objects[tdc.S3_SEEN_IDS_KEY])) == ["1", "2", "3"]
+
+
+def test_upload_part_to_s3_without_batches_writes_nothing(part_s3):
+    assert tdc.upload_part_to_s3() is True
+    assert part_s3.objects == {}
+
+
+def test_load_seen_video_ids_seeds_from_legacy_parquet(monkeypatch):
+    legacy = BytesIO()
+    tdc.pd.DataFrame({"video_id": ["a", "b"], "description": ["x", "y"]}).to_parquet(legacy, index=False)
+    monkeypatch.setattr(tdc, "s3_client", RecordingS3({tdc.S3_DATA_KEY: legacy.getvalue()}))
+    monkeypatch.setattr(tdc, "SEEN_VIDEO_IDS", tdc.pd.Index([], dtype=tdc.VIDEO_ID_DTYPE))
+
+    assert tdc.load_seen_video_ids() == 2
+    assert set(tdc.SEEN_VIDEO_IDS) == {"a", "b"}
+
+
+def test_load_seen_video_ids_prefers_sidecar(monkeypatch):
+    monkeypatch.setattr(tdc, "s3_client", RecordingS3({tdc.S3_SEEN_IDS_KEY: json.dumps(["z"])}))
+    monkeypatch.setattr(tdc, "SEEN_VIDEO_IDS", tdc.pd.Index([], dtype=tdc.VIDEO_ID_DTYPE))
+
+    assert tdc.load_seen_video_ids() == 1
+    assert set(tdc.SEEN_VIDEO_IDS) == {"z"}
+
+
+def test_legacy_parquet_migrates_into_parts_once(monkeypatch):
+    pq = pytest.importorskip("pyarrow.parquet")
+    legacy = BytesIO()
+    tdc.pd.DataFrame({
+        "video_id": ["a", "b"], "posted_ts": [1700000000.75, 1700000100.0], "description": ["x", "y"],
+        "author_id": ["1", "2"], "author_name": ["n1", "n2"], "follower_count": [10, 20],
+        "view_count": [100, 200], "like_count": [1, 2], "share_count": [0, 1], "comment_count": [3, 4],
+        "repost_count": [0, 0], "thumbnail_s3_key": ["raw/thumbnails/a.jpg", "raw/thumbnails/b.jpg"],
+    }).to_parquet(legacy, index=False)  # float timestamps, int64 counts, no top_comments
+    s3 = RecordingS3({tdc.S3_DATA_KEY: legacy.getvalue()})
+    monkeypatch.setattr(tdc, "s3_client", s3)
+    monkeypatch.setattr(tdc, "SEEN_VIDEO_IDS", tdc.pd.Index([], dtype=tdc.VIDEO_ID_DTYPE))
+
+    assert tdc.migrate_legacy_parquet() == 2
+    assert tdc.migrate_legacy_parquet() == 0  # the legacy key is gone after the first run
+
+    table = pq.read_table(BytesIO(s3.objects[tdc.S3_LEGACY_PART_KEY]))
+    assert table.schema.equals(tdc.BATCH_SCHEMA)
+    assert table.column("posted_ts").to_pylist() == [1700000000, 1700000100]
+    assert table.column("view_count").to_pylist() == [100, 200]
+    assert table.column("top_comments").to_pylist() == [None, None]
+    assert tdc.S3_DATA_KEY not in s3.objects
+    assert s3.objects[tdc.S3_LEGACY_ARCHIVE_KEY] == legacy.getvalue()
+    assert json.loads(s3.objects[tdc.S3_SEEN_IDS_KEY]) == ["a", "b"]
+
+
+# ---------- fetch_and_upload ----------
+@pytest.fixture
+def inline_pool(monkeypatch):
+    """Run resizes on a thread pool so monkeypatched functions are visible to the workers."""
+    pool = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(tdc, "get_resize_pool", lambda: pool)
+    yield pool
+    pool.shutdown()
+
+
+def test_fetch_and_upload_resizes_in_pool_then_uploads(monkeypatch, inline_pool):
+    uploads = []
+    monkeypatch.setattr(tdc, "resize_thumbnail", lambda data: data.upper())
+    monkeypatch.setattr(tdc, "upload_thumbnail_to_s3", lambda data, key: uploads.append((data, key)) or True)
+    client = StubClient({"https://cdn/1.jpg": StubResponse(200, b"jpeg-bytes")})
+
+    ok = asyncio.run(tdc.fetch_and_upload(client, asyncio.Semaphore(1), "1", "https://cdn/1.jpg", "thumbs/1.jpg"))
+
+    assert ok is True
+    assert uploads == [(b"JPEG-BYTES", "thumbs/1.jpg")]
+
+
+def test_fetch_and_upload_reports_http_failure_with_video_id(monkeypatch, caplog, inline_pool):
+    monkeypatch.setattr(tdc, "resize_thumbnail", lambda data: pytest.fail("should not resize"))
+    client = StubClient({"https://cdn/1.jpg": StubResponse(404)})
+
+    ok = asyncio.run(tdc.fetch_and_upload(client, asyncio.Semaphore(1), "1", "https://cdn/1.jpg", "thumbs/1.jpg"))
+
+    assert ok is False
+    assert "video 1" in caplog.text
+
+
+def test_fetch_and_upload_skips_upload_when_resize_fails(monkeypatch, caplog, inline_pool):
+    monkeypatch.setattr(tdc, "resize_thumbnail", lambda data: None)
+    monkeypatch.setattr(tdc, "upload_thumbnail_to_s3", lambda data, key: pytest.fail("should not upload"))
+    client = StubClient({"https://cdn/1.jpg": StubResponse(200, b"jpeg-bytes")})
+
+    ok = asyncio.run(tdc.fetch_and_upload(client, asyncio.Semaphore(1), "1", "https://cdn/1.jpg", "thumbs/1.jpg"))
+
+    assert ok is False
+    assert "Failed to upload thumbnail for video 1" in caplog.text
+
+
+def test_resize_pool_falls_back_to_threads_without_shm(monkeypatch):
+    def no_semaphores(*args, **kwargs):
+        raise OSError(38, "Function not implemented")
+
+    monkeypatch.setattr(tdc, "_RESIZE_POOL", None)
+    monkeypatch.setattr(tdc, "ProcessPoolExecutor", no_semaphores)
+
+    pool = tdc.get_resize_pool()
+    try:
+        assert isinstance(pool, ThreadPoolExecutor)
+        assert tdc.get_resize_pool() is pool
+    finally:
+        pool.shutdown()
+
+
+def test_resize_thumbnail_runs_in_forkserver_pool(monkeypatch):
+    monkeypatch.setattr(tdc, "_RESIZE_POOL", None)
+    pool = tdc.get_resize_pool()
+    try:
+        assert isinstance(pool, ProcessPoolExecutor)
+        assert pool._mp_context.get_start_method() == "forkserver"  # no fork() of a threaded process
+        thumbnail = pool.submit(tdc.resize_thumbnail, make_jpeg()).result()
+    finally:
+        pool.shutdown()
+
+    with tdc.Image.open(BytesIO(thumbnail)) as im:
+        assert im.size == (256, 256)
+
+
+# ---------- resolve_pending_thumbnails ----------
+def test_resolve_pending_thumbnails_keeps_only_uploaded_rows():
+    async def resolve():
+        async def upload(ok):
+            return ok
+
+        pending = [
+            {"row": make_row(vid), "upload": asyncio.ensure_future(upload(vid != "bad"))}
+            for vid in ("a", "bad", "c")
+        ]
+        return await tdc.resolve_pending_thumbnails(pending)
+
+    resolved = asyncio.run(resolve())
+
+    assert [row.video_id for row in resolved] == ["a", "c"]
+
+
+# ---------- collect_tiktok_data ----------
+def test_batches_flush_every_batch_size_rows(collector):
+    result, saved = collector({"tag": videos("1", "2", "3", "4", "5", "6", "7")}, batch_size=3)
+
+    assert saved == [["1", "2", "3"], ["4", "5", "6"], ["7"]]
+    assert json.loads(result["body"])["videos_processed"] == 7
+
+
+def test_failed_thumbnails_do_not_count_toward_videos_per_tag(collector):
+    result, saved = collector({"tag": videos("1", "2", "3", "4", "5", "6")}, batch_size=100,
+                              videos_per_tag=4, fail={"2"})
+
+    assert saved == [["1", "3", "4", "5"]]
+    assert json.loads(result["body"])["videos_processed"] == 4
+
+
+def test_pending_thumbnails_are_flushed_at_end_of_each_tag(collector):
+    result, saved = collector({"a": videos("1", "2"), "b": videos("3", "4")}, batch_size=100, fail={"4"})
+
+    assert saved == [["1", "2", "3"]]
+    assert result["statusCode"] == 200
+    assert json.loads(result["body"])["videos_processed"] == 3
+
+
+def test_tags_run_concurrently_on_free_sessions(collector, monkeypatch):
+    for i in range(1, 4):
+        monkeypatch.setenv(f"MS_TOKEN_{i}", f"token{i}")
+
+    # "b" finishes first, so "d" must take its session rather than "a"'s (which is still live)
+    result, saved = collector({"a": videos("1", "2", "3"), "b": videos("4"), "c": videos("5", "6"),
+                               "d": videos("7", "8")}, batch_size=100)
+
+    assert FakeTikTokApi.num_sessions == 3
+    assert sorted(FakeTikTokApi.calls) == [("a", 0), ("b", 1), ("c", 2), ("d", 1)]
+    assert sorted(saved[0]) == ["1", "2", "3", "4", "5", "6", "7", "8"]
+    assert json.loads(result["body"])["videos_processed"] == 8
+
+
+# ---------- logging ----------
+def test_per_comment_messages_are_debug_only(caplog):
+    class FakeComment:
+        def __init__(self, likes, text):
+            self.as_dict = {"digg_count": likes}
+            self.text = text
+
+    class CommentVideo:
+        def comments(self, count):
+            async def gen():
+                for likes in (3, 9, 1):
+                    yield FakeComment(likes, f"comment {likes}")
+            return gen()
+
+    caplog.set_level(logging.WARNING, logger=tdc.logger.name)
+    top = asyncio.run(tdc.fetch_top_comments(CommentVideo(), n=2))
+
+    assert top == ["comment 9", "comment 3"]
+    assert caplog.records == []
+
+
+# ---------- hashtags ----------
+def test_extract_hashtags_uses_precompiled_pattern():
+    assert isinstance(tdc.HASHTAG_RE, tdc.re.Pattern)
+    assert tdc.extract_hashtags("glow #kbeauty #skin_care2 #メイク") == ["kbeauty", "skin_care2"]
+
+
+# ---------- warm-container reuse ----------
+def test_tiktok_api_sessions_start_once_per_container(monkeypatch):
+    created = []
+
+    class CountingApi(FakeTikTokApi):
+        async def create_sessions(self, num_sessions, **kwargs):
+            created.append(num_sessions)
+
+    hooks = []
+    monkeypatch.setattr(tdc, "TikTokApi", CountingApi)
+    monkeypatch.setattr(tdc, "_API", None)
+    monkeypatch.setattr(tdc, "_API_LOCK", None)
+    monkeypatch.setattr(tdc, "_SHUTDOWN_HOOKS_INSTALLED", False)
+    real_signal = tdc.signal.signal
+
+    def record_signal(signum, handler):  # asyncio.run() sets SIGINT itself; only record SIGTERM
+        if signum != tdc.signal.SIGTERM:
+            return real_signal(signum, handler)
+        hooks.append(handler)
+
+    monkeypatch.setattr(tdc.signal, "signal", record_signal)
+    monkeypatch.setattr(tdc.atexit, "register", hooks.append)
+
+    async def invoke_twice():
+        first = await tdc.get_tiktok_api(["token"], 1)
+        second = await tdc.get_tiktok_api(["token"], 1)
+        await tdc.close_tiktok_api()
+        return first, second
+
+    first, second = asyncio.run(invoke_twice())
+
+    assert first is second
+    assert created == [1]
+    assert tdc._API is None
+    assert hooks == [tdc.shutdown_tiktok_api, tdc.handle_sigterm]  # installed with the browser, once
+
+
+def test_sigterm_mid_invocation_closes_browser_on_the_running_loop(monkeypatch):
+    closed = []
+
+    class ClosingApi(FakeTikTokApi):
+        async def __aexit__(self, *exc):
+            closed.append(True)
+
+    loop = asyncio.new_event_loop()
+    monkeypatch.setattr(tdc, "_LOOP", loop)
+    monkeypatch.setattr(tdc, "_API", ClosingApi())
+
+    async def invocation():
+        tdc.handle_sigterm(tdc.signal.SIGTERM, None)  # must not re-enter the running loop
+        await asyncio.sleep(5)
+
+    try:
+        with pytest.raises(SystemExit):
+            loop.run_until_complete(invocation())
+    finally:
+        loop.close()
+    assert closed == [True]
+    assert tdc._API is None
+
+
+def test_failed_collection_drops_cached_api(collector, monkeypatch):
+    async def broken_gather(*aws, **kwargs):
+        for aw in aws:
+            aw.close()
+        raise RuntimeError("browser crashed")
+
+    monkeypatch.setattr(tdc.asyncio, "gather", broken_gather)
+
+    result, saved = collector({"tag": videos("1")}, batch_size=10)
+
+    assert result["statusCode"] == 500
+    assert tdc._API is None
+
+
+def test_lambda_handler_reuses_its_event_loop(monkeypatch):
+    async def fake_collect(start_time):
+        return asyncio.get_running_loop()
+
+    monkeypatch.setattr(tdc, "collect_tiktok_data", fake_collect)
+    monkeypatch.setattr(tdc, "_LOOP", None)
+
+    first = tdc.lambda_handler({}, None)
+    try:
+        assert tdc.lambda_handler({}, None) is first
+        assert not first.is_closed()
+    finally:
+        first.close()
+
+
+# ---------- per-video concurrency ----------
+def commented_videos(*ids):
+    result = videos(*ids)
+    for video in result:
+        video.stats["commentCount"] = 1
+    return result
+
+
+def test_thumbnail_upload_overlaps_comment_fetch(collector, monkeypatch):
+    events = []
+
+    async def fake_fetch_and_upload(client, semaphore, video_id, cover_url, s3_key):
+        events.append(("upload-start", video_id))
+        await asyncio.sleep(0)
+        events.append(("upload-end", video_id))
+        return True
+
+    async def fake_comments(video, n):
+        events.append(("comments-start", video.id))
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        events.append(("comments-end", video.id))
+        return ["top"]
+
+    monkeypatch.setattr(tdc, "fetch_and_upload", fake_fetch_and_upload)
+    monkeypatch.setattr(tdc, "fetch_top_comments", fake_comments)
+
+    result, saved = collector({"tag": commented_videos("1")}, batch_size=10)
+
+    assert saved == [["1"]]
+    assert events.index(("upload-end", "1")) < events.index(("comments-end", "1"))
+
+
+def test_slow_comment_fetch_times_out_without_dropping_video(collector, monkeypatch):
+    async def hanging_comments(video, n):
+        await asyncio.sleep(60)
+
+    monkeypatch.setattr(tdc, "fetch_top_comments", hanging_comments)
+    monkeypatch.setattr(tdc, "VIDEO_TASK_TIMEOUT", 0.01)
+
+    result, saved = collector({"tag": commented_videos("1", "2")}, batch_size=10)
+
+    assert saved == [["1", "2"]]
+    assert json.loads(result["body"])["videos_processed"] == 2